@@ -543,6 +543,7 @@ def main(url):
             a.close()
 
 
-create_folder()
-clear_files()
-main(MAIN_URL)
+if __name__ == '__main__':
+    create_folder()
+    clear_files()
+    main(MAIN_URL)
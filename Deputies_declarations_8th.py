@@ -10,17 +10,36 @@ import time
 import socket
 import errno
 import csv
+import threading
+import http.client
+import gzip
+import zlib
+import json
+import hashlib
+import operator
+import base64
+import contextlib
+import argparse
+import shutil
+import decimal
+import random
+import sqlite3
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
+from collections import deque
 from urllib.request import urlopen, urlretrieve
-from copy import copy
+from functools import lru_cache
 
-from bs4 import BeautifulSoup
-from unidecode import unidecode
-from pyquery import PyQuery as pq
+# bs4, lxml, pyquery and unidecode are imported where they are used, so commands which do not parse pages start quickly
 
 # Global constants
 ENCODING = 'cp1251'
 
-MAIN_URL = 'http://w1.c1.rada.gov.ua/pls/site2/fetch_mps?skl_id=9'
+# Deputies list of a convocation (skl_id); CONVOCATIONS are crawled when no other ones are given
+MAIN_URL_PATTERN = 'http://w1.c1.rada.gov.ua/pls/site2/fetch_mps?skl_id=%s'
+CONVOCATIONS = [9]
+MAIN_URL = MAIN_URL_PATTERN % CONVOCATIONS[-1]
 DECLARATION_LIST_URL_PATTERN = 'http://gapp.rada.gov.ua/declview/home/preview/%s'
 DECLARATION_URL_PATTERN = 'http://gapp.rada.gov.ua%s'
 
@@ -29,16 +48,684 @@ TSV_FILE = FOLDER + 'declarations.tsv'
 CSV_FILE = FOLDER + 'list.csv'
 NO_DEC_FILE = FOLDER + 'no_dec.csv'
 NO_PAGE_FILE = FOLDER + 'no_page.csv'
+DEPUTIES_FILE = FOLDER + 'deputies.csv'
+CACHE_FOLDER = FOLDER + 'cache/'
+JOURNAL_FILE = FOLDER + 'journal.jsonl'
+METRICS_FILE = FOLDER + 'metrics.json'
+REQUESTS_LOG_FILE = FOLDER + 'requests.csv'
+# SQLite database written besides the text files, None to skip it
+SQLITE_FILE = None
+# Compressed declaration pages for the reparse command, None to skip archiving
+ARCHIVE_FILE = FOLDER + 'archive.sqlite'
+# Hashes of (person, declaration_year, decl_section) blocks of declarations.tsv kept for the next run,
+# and rows added and removed since the previous run by block; CHANGES_FILE = None skips both
+BLOCKS_FILE = FOLDER + 'blocks.json'
+CHANGES_FILE = FOLDER + 'changes.jsonl'
+# Declaration links and years of every deputy's preview page with the page hash, None to parse every preview page
+INDEX_FILE = FOLDER + 'preview_index.json'
+# Deputies queue of the distributed crawl, shared by the coordinator and the workers
+QUEUE_FILE = FOLDER + 'queue.sqlite'
 
 FIELDS = ['person', 'position', 'declaration_year', 'source_type', 'point_code', 'point_title', 'declarer/family', 'content',
           'Sum1_property', 'Sum2_leasing', 'Name_of_country', 'Name_of_currency', 'Sum3_income_in_currency', 'block', 'additional_information', 'decl_section']
 
-# Globals for catching exceptions
-SLEEP_TIME = 4
-TRIES = 2
+# Retries of one request for every kind of failure; pause before a retry grows
+# exponentially from BACKOFF_BASE up to BACKOFF_MAX seconds, with random jitter
+RETRIES = {'timeout': 3, 'server': 4, 'reset': 3, 'other': 1}
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+# Crawl settings: number of deputies fetched at once
+WORKERS = 4
+# Request rate for every host starts at REQUESTS_PER_SECOND and grows by RATE_INCREASE
+# after each successful request up to MAX_REQUESTS_PER_SECOND. When the share of failed
+# requests exceeds ERROR_RATE_LIMIT, the rate is halved down to MIN_REQUESTS_PER_SECOND
+REQUESTS_PER_SECOND = 1.0
+MAX_REQUESTS_PER_SECOND = 8.0
+MIN_REQUESTS_PER_SECOND = 0.1
+RATE_INCREASE = 0.05
+ERROR_RATE_LIMIT = 0.1
+BURST = 2
+
+# Number of the slowest deputies listed in METRICS_FILE
+SLOWEST_DEPUTIES = 10
+# Processes parsing declaration pages, 0 parses them in the main process
+PARSE_WORKERS = os.cpu_count() or 1
+# Archived pages sent to a parse worker at once by the reparse command
+REPARSE_CHUNK = 16
+# Deputies written between flushes of the output files to disk
+CHECKPOINT_EVERY = 10
+# PDF declarations downloaded at once, read from the socket by DOWNLOAD_CHUNK_SIZE bytes
+PDF_WORKERS = 2
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Characters of a declaration page fed to the 'stream' parser at once
+PARSE_CHUNK_SIZE = 64 * 1024
+# Distributed crawl: seconds a worker holds leased deputies before they are given to another worker
+# (a running worker renews its leases every third of it), leases of a deputy before it is given up,
+# seconds between checks of the queue
+LEASE_SECONDS = 5 * 60
+LEASE_ATTEMPTS = 3
+QUEUE_POLL = 1.0
+
+# HTTP settings: seconds to wait for the server, gzip/deflate negotiation
+TIMEOUT = 60
+ACCEPT_COMPRESSION = True
+MAX_REDIRECTS = 5
+
+# HTTP cache settings. Seconds a cached page is used without asking the server, by url part;
+# None means the page never changes. Pages matching no pattern are revalidated every time
+CACHE_MAX_AGE = [
+    ('/fetch_mps', 60 * 60),
+    ('/declview/home/preview/', 24 * 60 * 60),
+    ('/declview/', None),
+]
+CACHE_MAX_SIZE = 2 * 1024 ** 3
+# True to replay the crawl from the cache only, without network access
+CACHE_ONLY = False
 
 VALUES_ORDER = ['декларант', 'сім\'я']
 
+# Column types for --export (Parquet or Arrow), fields not listed are strings.
+# content is kept as a string, its numeric value goes to content_value
+EXPORT_TYPES = {
+    'declaration_year': 'int',
+    'Sum1_property': 'decimal',
+    'Sum2_leasing': 'decimal',
+    'Sum3_income_in_currency': 'decimal',
+    'person': 'dictionary',
+    'decl_section': 'dictionary',
+    'point_title': 'dictionary',
+}
+DECIMAL_PRECISION = 38
+DECIMAL_SCALE = 4
+EXPORT_BATCH_SIZE = 50000
+NUMBER_RE = re.compile(r'^-?\d+(?:[.,]\d+)?$')
+
+# Columns of the summary table (summary command): sum of the field over the rows of the sections
+# whose point_title matches the pattern. Totals rows are taken where the declaration has them,
+# the 'закордоном' rows are parts of the other rows
+SUMMARY_COLUMNS = [
+    ('income', ['II'], 'content', '^Загальна сума сукупного доходу'),
+    ('property', ['III', 'IV'], 'Sum1_property', ''),
+    ('deposits', ['V'], 'content', '^Сума коштів на рахунках(?!.*закордоном$)'),
+    ('liabilities', ['VI'], 'content', '^(?!.*закордоном$)'),
+]
+# Name_of_currency beginnings (lower case) and their ISO codes
+CURRENCY_CODES = [
+    ('євро', 'EUR'), ('eur', 'EUR'), ('дол', 'USD'), ('usd', 'USD'), ('руб', 'RUB'), ('rur', 'RUB'),
+    ('rub', 'RUB'), ('фунт', 'GBP'), ('gbp', 'GBP'), ('франк', 'CHF'), ('chf', 'CHF'), ('грн', 'UAH'),
+    ('uah', 'UAH'), ('€', 'EUR'), ('$', 'USD'), ('£', 'GBP'),
+]
+SUMMARY_FILE = FOLDER + 'summary.csv'
+
+# HTML parser for declaration and preview pages: 'lxml' (fast), 'bs4' (BeautifulSoup)
+# or 'stream' (lxml, declaration pages are parsed table by table in bounded memory)
+PARSER = 'lxml'
+PARSERS = ['lxml', 'bs4', 'stream']
+
+# Tags BeautifulSoup writes as <tag/>
+VOID_ELEMENTS = set(['area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'menuitem',
+                     'meta', 'param', 'source', 'track', 'wbr', 'basefont', 'bgsound', 'command', 'frame',
+                     'image', 'isindex', 'nextid', 'spacer'])
+PRESERVE_WHITESPACE = set(['pre', 'textarea'])
+ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+
+
+class TokenBucket(object):
+    '''
+    Request rate limit of one host with AIMD adjustment: the rate grows slowly while requests succeed
+    and is halved when errors become frequent. Rate 0 means no limit
+    '''
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = BURST
+        self.updated = time.time()
+        self.error_rate = 0.0
+        self.decreased = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            if not self.rate:
+                return
+            now = time.time()
+            self.tokens = min(BURST, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # the token is taken in advance, so waiting threads queue up one after another
+            self.tokens -= 1
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+        if delay > 0:
+            time.sleep(delay)
+
+    def succeeded(self):
+        with self.lock:
+            self.error_rate *= 0.9
+            if self.rate:
+                self.rate = min(MAX_REQUESTS_PER_SECOND, self.rate + RATE_INCREASE)
+
+    def failed(self, throttle):
+        with self.lock:
+            self.error_rate = self.error_rate * 0.9 + 0.1
+            now = time.time()
+            # one decrease per interval between requests, several failed requests in flight count once
+            if throttle and self.rate and self.error_rate > ERROR_RATE_LIMIT and now - self.decreased > 1 / self.rate:
+                self.rate = max(MIN_REQUESTS_PER_SECOND, self.rate / 2)
+                self.decreased = now
+
+
+class RequestScheduler(object):
+    '''
+    Keeps a TokenBucket for every host
+    '''
+
+    def __init__(self, rate=REQUESTS_PER_SECOND):
+        self.rate = rate
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, url):
+        host = urllib.parse.urlsplit(url).netloc
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.rate)
+            return self.buckets[host]
+
+
+def failure_class(error):
+    '''
+    Sorts request errors: 'timeout', 'server' (5xx and 429), 'reset' (broken connections),
+    'client' (other 4xx, never retried) and 'other'
+    '''
+    if isinstance(error, urllib.error.HTTPError):
+        return 'server' if error.code == 429 or error.code >= 500 else 'client'
+    if isinstance(error, (socket.timeout, TimeoutError)):
+        return 'timeout'
+    if isinstance(error, (ConnectionError, http.client.HTTPException)):
+        return 'reset'
+    return 'other'
+
+
+def backoff(attempt, error=None):
+    '''
+    Seconds to wait before the next attempt: Retry-After of the server or exponential backoff with full jitter
+    '''
+    retry_after = getattr(error, 'headers', None) and error.headers.get('Retry-After')
+    if retry_after and retry_after.isdigit():
+        return min(BACKOFF_MAX, int(retry_after))
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+class HTTPSession(object):
+    '''
+    Keeps connections open between requests (keep-alive), so every host is connected to only once per thread
+    '''
+
+    def __init__(self, timeout=TIMEOUT, compression=ACCEPT_COMPRESSION, pool_size=WORKERS):
+        self.timeout = timeout
+        self.compression = compression
+        self.pool_size = pool_size
+        self.pool = {}
+        self.lock = threading.Lock()
+        self.headers = dict(urllib.request.OpenerDirector().addheaders)
+        if compression:
+            self.headers['Accept-Encoding'] = 'gzip, deflate'
+
+    def acquire(self, scheme, host):
+        '''
+        Returns an idle connection to the host or a new one. The second value tells if the connection was reused
+        '''
+        with self.lock:
+            idle = self.pool.get((scheme, host))
+            if idle:
+                return idle.pop(), True
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, timeout=self.timeout), False
+        return http.client.HTTPConnection(host, timeout=self.timeout), False
+
+    def release(self, scheme, host, connection):
+        with self.lock:
+            idle = self.pool.setdefault((scheme, host), [])
+            if len(idle) < self.pool_size:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        with self.lock:
+            for idle in self.pool.values():
+                for connection in idle:
+                    connection.close()
+            self.pool = {}
+
+    def request(self, url, headers=None, timeout=None):
+        '''
+        Makes GET request following redirects. Returns (status, headers, body); body is already decompressed.
+        Raises urllib.error.HTTPError for 4xx/5xx answers like urlopen does
+        '''
+        for redirect in range(MAX_REDIRECTS + 1):
+            status, response_headers, body = self.request_once(url, headers, timeout)
+            if status in (301, 302, 303, 307, 308) and response_headers.get('Location'):
+                url = urllib.parse.urljoin(url, response_headers['Location'])
+                continue
+            if status >= 400:
+                raise urllib.error.HTTPError(url, status, http.client.responses.get(status, ''),
+                                             response_headers, None)
+            return status, response_headers, body
+        raise urllib.error.URLError('too many redirects: ' + url)
+
+    def request_once(self, url, headers=None, timeout=None):
+        parts = urllib.parse.urlsplit(url)
+        request_headers = dict(self.headers)
+        if headers:
+            request_headers.update(headers)
+        connection, response = self.send(parts, 'GET', request_headers, timeout)
+        try:
+            body = response.read()
+        except Exception:
+            connection.close()
+            raise
+        self.finish(parts, connection, response)
+        return response.status, response.headers, decompress(body, response.headers.get('Content-Encoding'))
+
+    @contextlib.contextmanager
+    def stream(self, url, headers=None, timeout=None, method='GET'):
+        '''
+        Makes request following redirects and yields the response, so the caller reads the body in chunks.
+        The body is asked without compression. Raises urllib.error.HTTPError for 4xx/5xx answers
+        '''
+        request_headers = dict(self.headers)
+        request_headers['Accept-Encoding'] = 'identity'
+        if headers:
+            request_headers.update(headers)
+        for redirect in range(MAX_REDIRECTS + 1):
+            parts = urllib.parse.urlsplit(url)
+            connection, response = self.send(parts, method, request_headers, timeout)
+            location = response.status in (301, 302, 303, 307, 308) and response.headers.get('Location')
+            if location or response.status >= 400:
+                try:
+                    response.read()
+                except Exception:
+                    connection.close()
+                    raise
+                self.finish(parts, connection, response)
+                if location:
+                    url = urllib.parse.urljoin(url, location)
+                    continue
+                raise urllib.error.HTTPError(url, response.status, http.client.responses.get(response.status, ''),
+                                             response.headers, None)
+            try:
+                yield response
+            except BaseException:
+                connection.close()
+                raise
+            # the connection can be reused only if the caller has read the whole body
+            if response.isclosed():
+                self.finish(parts, connection, response)
+            else:
+                connection.close()
+            return
+        raise urllib.error.URLError('too many redirects: ' + url)
+
+    def send(self, parts, method, headers, timeout=None):
+        '''
+        Sends request over a pooled connection and returns (connection, response) with the body not read yet
+        '''
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        while True:
+            connection, reused = self.acquire(parts.scheme, parts.netloc)
+            connection.timeout = timeout or self.timeout
+            if connection.sock is not None:
+                connection.sock.settimeout(connection.timeout)
+            try:
+                connection.request(method, path, headers=headers)
+                return connection, connection.getresponse()
+            except (http.client.HTTPException, ConnectionError):
+                connection.close()
+                # the server could close an idle keep-alive connection, try once more with a new one
+                if reused:
+                    continue
+                raise
+            except Exception:
+                connection.close()
+                raise
+
+    def finish(self, parts, connection, response):
+        '''
+        Returns the connection to the pool after the response body was read
+        '''
+        if response.will_close:
+            connection.close()
+        else:
+            self.release(parts.scheme, parts.netloc, connection)
+
+
+def decompress(body, content_encoding):
+    '''
+    Decodes gzip or deflate response body
+    '''
+    if content_encoding == 'gzip':
+        return gzip.decompress(body)
+    if content_encoding == 'deflate':
+        try:
+            return zlib.decompress(body)
+        except zlib.error:
+            # some servers send raw deflate stream without zlib header
+            return zlib.decompress(body, -zlib.MAX_WBITS)
+    return body
+
+
+@contextlib.contextmanager
+def process_lock(file_name):
+    '''
+    Holds an exclusive lock of file_name against the other processes, e.g. the workers of a distributed crawl.
+    Does nothing where fcntl is missing
+    '''
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with open(file_name, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class ResponseCache(object):
+    '''
+    On-disk HTTP cache. Bodies are stored once per content hash in objects/,
+    index.json maps url to body hash, headers and fetch time in least recently used order
+    '''
+    SAVE_EVERY = 50
+
+    def __init__(self, folder, max_size=CACHE_MAX_SIZE):
+        self.folder = folder
+        self.max_size = max_size
+        self.entries = None
+        self.unsaved = 0
+        self.lock = threading.RLock()
+
+    def load(self):
+        if self.entries is not None:
+            return
+        self.entries = OrderedDict()
+        self.merge()
+
+    def save(self):
+        '''
+        Writes index.json merged with the entries other processes sharing the folder have saved meanwhile
+        '''
+        with self.lock:
+            if self.entries is None or not self.unsaved:
+                return
+            os.makedirs(self.folder, exist_ok=True)
+            with process_lock(self.folder + 'index.lock'):
+                self.merge()
+                tmp = '%sindex.json.%d.tmp' % (self.folder, os.getpid())
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    json.dump(list(self.entries.values()), f, ensure_ascii=False)
+                os.replace(tmp, self.folder + 'index.json')
+            self.unsaved = 0
+
+    def merge(self):
+        '''
+        Adds the saved entries this process does not know, whose bodies are still there,
+        and takes the saved entries fetched later than the own ones
+        '''
+        try:
+            with open(self.folder + 'index.json', encoding='utf-8') as f:
+                saved = dict((entry['url'], entry) for entry in json.load(f))
+        except (IOError, ValueError):
+            saved = {}
+        entries = OrderedDict()
+        for url, entry in saved.items():
+            if url not in self.entries and os.path.exists(self.object_path(entry['body'])):
+                entries[url] = entry
+        for url, entry in self.entries.items():
+            if url in saved and saved[url]['fetched'] > entry['fetched'] and \
+                    os.path.exists(self.object_path(saved[url]['body'])):
+                entry = saved[url]
+            entries[url] = entry
+        self.entries = entries
+        self.refs = {}
+        for entry in self.entries.values():
+            self.refs[entry['body']] = self.refs.get(entry['body'], 0) + 1
+        self.size = sum(self.object_size(body_hash) for body_hash in self.refs)
+
+    def object_path(self, body_hash):
+        return self.folder + 'objects/' + body_hash[:2] + '/' + body_hash
+
+    def object_size(self, body_hash):
+        try:
+            return os.path.getsize(self.object_path(body_hash))
+        except OSError:
+            return 0
+
+    def get(self, url):
+        '''
+        Returns (entry, body) for the cached url or (None, None)
+        '''
+        with self.lock:
+            self.load()
+            entry = self.entries.get(url)
+            if entry is None:
+                return None, None
+            try:
+                with open(self.object_path(entry['body']), 'rb') as f:
+                    body = f.read()
+            except IOError:
+                self.remove(url)
+                return None, None
+            self.entries.move_to_end(url)
+            return entry, body
+
+    def put(self, url, headers, body):
+        body_hash = hashlib.sha1(body).hexdigest()
+        path = self.object_path(body_hash)
+        with self.lock:
+            self.load()
+            if url in self.entries:
+                self.remove(url)
+            if body_hash not in self.refs:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp = '%s.%d.tmp' % (path, os.getpid())
+                with open(tmp, 'wb') as f:
+                    f.write(body)
+                os.replace(tmp, path)
+                self.size += len(body)
+            self.refs[body_hash] = self.refs.get(body_hash, 0) + 1
+            self.entries[url] = {'url': url, 'body': body_hash, 'fetched': time.time(),
+                                 'headers': dict(headers or {})}
+            self.evict()
+            self.changed()
+
+    def refresh(self, url):
+        '''
+        Marks the cached url as just checked after 304 Not Modified answer
+        '''
+        with self.lock:
+            self.load()
+            if url in self.entries:
+                self.entries[url]['fetched'] = time.time()
+                self.changed()
+
+    def remove(self, url):
+        entry = self.entries.pop(url)
+        self.refs[entry['body']] -= 1
+        if not self.refs[entry['body']]:
+            del self.refs[entry['body']]
+            self.size -= self.object_size(entry['body'])
+            try:
+                os.remove(self.object_path(entry['body']))
+            except OSError:
+                pass
+        self.changed()
+
+    def evict(self):
+        while self.size > self.max_size and len(self.entries) > 1:
+            self.remove(next(iter(self.entries)))
+
+    def changed(self):
+        self.unsaved += 1
+        if self.unsaved >= self.SAVE_EVERY:
+            self.save()
+
+
+def cache_max_age(url):
+    '''
+    Returns how long the cached url may be used without revalidation, None means forever
+    '''
+    for pattern, max_age in CACHE_MAX_AGE:
+        if pattern in url:
+            return max_age
+    return 0
+
+
+def is_fresh(entry):
+    max_age = cache_max_age(entry['url'])
+    return max_age is None or time.time() - entry['fetched'] < max_age
+
+
+def validators(entry):
+    '''
+    Returns conditional request headers for the cached entry
+    '''
+    headers = {}
+    for name, header in (('ETag', 'If-None-Match'), ('Last-Modified', 'If-Modified-Since')):
+        for key, value in entry['headers'].items():
+            if key.lower() == name.lower():
+                headers[header] = value
+    return headers
+
+
+def url_class(url):
+    if '/fetch_mps' in url:
+        return 'mp_list'
+    if '/declview/home/preview/' in url:
+        return 'preview'
+    if 'GetFile' in url:
+        return 'pdf'
+    if '/declview/' in url:
+        return 'declaration'
+    return 'other'
+
+
+def percentiles(values):
+    '''
+    Returns p50/p95/p99/max of the values by nearest rank
+    '''
+    values = sorted(values)
+    if not values:
+        return {}
+    res = {}
+    for name, share in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+        res[name] = round(values[min(len(values) - 1, int(share * len(values)))], 4)
+    res['max'] = round(values[-1], 4)
+    return res
+
+
+class RunMetrics(object):
+    '''
+    Collects timings of the run: every request from get_page(), parse time of every section of parse_decl()
+    and the time spent on every deputy. report() writes JSON summary and CSV log of requests
+    '''
+    SECTIONS = ['I', 'II', 'III', 'IV', 'V', 'VI']
+
+    def __init__(self):
+        self.started = time.time()
+        self.requests = []
+        self.sections = dict((section, []) for section in self.SECTIONS)
+        self.people = []
+        self.lock = threading.Lock()
+
+    def request(self, url, seconds, size, info):
+        with self.lock:
+            self.requests.append((url_class(url), url, seconds, size, info['status'], info['retries'], info['cache']))
+
+    def parse(self, timings):
+        with self.lock:
+            for section, seconds in timings.items():
+                self.sections[section].append(seconds)
+
+    def person(self, person_name, seconds):
+        with self.lock:
+            self.people.append((seconds, person_name))
+
+    def summary(self):
+        duration = time.time() - self.started
+        by_class = {}
+        for kind, url, seconds, size, status, retries, cache in self.requests:
+            stats = by_class.setdefault(kind, {'count': 0, 'bytes': 0, 'retries': 0, 'failed': 0,
+                                               'cache': {}, 'latency': []})
+            stats['count'] += 1
+            stats['bytes'] += size
+            stats['retries'] += retries
+            # 206 of the resumed downloads and 304 of the revalidated pages are answers as good as 200,
+            # status is the failure class instead of a code when there was no answer
+            stats['failed'] += 0 if isinstance(status, int) and status < 400 or cache == 'hit' else 1
+            stats['cache'][cache] = stats['cache'].get(cache, 0) + 1
+            stats['latency'].append(seconds)
+        for stats in by_class.values():
+            stats['latency'] = percentiles(stats['latency'])
+        total_bytes = sum(request[3] for request in self.requests)
+        return {
+            'started': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started)),
+            'duration': round(duration, 3),
+            'requests': len(self.requests),
+            'requests_per_second': round(len(self.requests) / duration, 3) if duration else None,
+            'bytes': total_bytes,
+            'bytes_per_second': round(total_bytes / duration) if duration else None,
+            'latency': percentiles([request[2] for request in self.requests]),
+            'by_url_class': by_class,
+            'declarations_parsed': len(self.sections['I']),
+            'parse_sections': dict((section, dict(percentiles(times), total=round(sum(times), 3)))
+                                   for section, times in self.sections.items() if times),
+            'slowest_deputies': [{'person': person_name, 'seconds': round(seconds, 3)}
+                                 for seconds, person_name in sorted(self.people, reverse=True)[:SLOWEST_DEPUTIES]],
+        }
+
+    def report(self, json_file, csv_file):
+        with self.lock:
+            with open(json_file, 'w', encoding='utf-8') as f:
+                json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+            with open(csv_file, 'w', encoding='utf-8', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['url_class', 'url', 'seconds', 'bytes', 'status', 'retries', 'cache'])
+                for request in self.requests:
+                    writer.writerow(request[:2] + (round(request[2], 4),) + request[3:])
+
+
+class SectionTimer(object):
+    '''
+    Called at the end of every section of parse_decl(), puts the time since the previous call to timings
+    '''
+
+    def __init__(self, timings):
+        self.timings = timings
+        self.last = time.perf_counter()
+
+    def __call__(self, section):
+        now = time.perf_counter()
+        if self.timings is not None:
+            self.timings[section] = now - self.last
+        self.last = now
+
+
+SCHEDULER = RequestScheduler()
+METRICS = RunMetrics()
+SESSION = HTTPSession()
+CACHE = ResponseCache(CACHE_FOLDER)
+# locks of the files being downloaded, by file name
+FILE_LOCKS = {}
+FILE_LOCKS_GUARD = threading.Lock()
+# PDF file names given in this run: file name -> (person_id, link of the declaration)
+PDF_FILE_NAMES = {}
+
 
 def create_folder():
     '''
@@ -50,16 +737,435 @@ def create_folder():
         pass
 
 
-def clear_files():
-    open(TSV_FILE, 'w').close()
-    a = codecs.open(TSV_FILE, 'a', encoding='utf-8')
-    for field in FIELDS:
-        a.write(field + '\t')
-    a.write('\n')
-    a.close()
-    open(NO_DEC_FILE, 'w').close()
-    open(NO_PAGE_FILE, 'w').close()
-    open(CSV_FILE, 'w').close()
+def tsv_header():
+    return ''.join(field + '\t' for field in FIELDS) + '\n'
+
+
+def output_files():
+    return {'tsv': TSV_FILE, 'list': CSV_FILE, 'no_dec': NO_DEC_FILE, 'no_page': NO_PAGE_FILE}
+
+
+class OutputSink(object):
+    '''
+    Keeps all output files open during the run. Lines are written to <file>.part with large buffers,
+    checkpoint() flushes them to disk and writes the journal, close() renames the files to the final names.
+    keep - files whose content from the previous run is kept; sizes - checkpoint of the interrupted run to resume;
+    database - optional SQLiteSink, archive - optional PageArchive, both committed at the same checkpoints;
+    an archive written to <file>.part replaces the archive of the previous runs at close()
+    '''
+    BUFFER_SIZE = 1024 * 1024
+
+    def __init__(self, keep=(), sizes=None, database=None, archive=None):
+        self.files = {}
+        self.done = []
+        self.database = database
+        self.archive = archive
+        for key, file_name in output_files().items():
+            part = file_name + '.part'
+            if sizes is not None:
+                if not os.path.exists(part):
+                    if os.path.exists(file_name):
+                        shutil.copyfile(file_name, part)
+                    else:
+                        open(part, 'w').close()
+                # cut off the lines written after the last checkpoint
+                with open(part, 'r+b') as f:
+                    f.truncate(sizes.get(key, 0))
+            elif key in keep and os.path.exists(file_name):
+                shutil.copyfile(file_name, part)
+            else:
+                open(part, 'w').close()
+            if key == 'tsv':
+                self.files[key] = open(part, 'a', encoding='utf-8', newline='', buffering=self.BUFFER_SIZE)
+            else:
+                self.files[key] = open(part, 'a', buffering=self.BUFFER_SIZE)
+        if not os.path.getsize(TSV_FILE + '.part'):
+            self.files['tsv'].write(tsv_header())
+        self.writer = csv.writer(self.files['tsv'], delimiter='\t')
+
+    def write_lines(self, key, lines):
+        self.files[key].write(''.join(lines))
+
+    def write_rows(self, rows):
+        self.writer.writerows(rows)
+
+    def sizes(self):
+        return dict((key, os.fstat(f.fileno()).st_size) for key, f in self.files.items())
+
+    def add_done(self, person_id, declarations):
+        '''
+        Remembers the deputy written to the files, checkpoints every CHECKPOINT_EVERY deputies
+        '''
+        self.done.append((person_id, declarations))
+        if len(self.done) >= CHECKPOINT_EVERY:
+            self.checkpoint()
+
+    def checkpoint(self):
+        if self.database is not None:
+            self.database.commit()
+        if self.archive is not None:
+            self.archive.commit()
+        for f in self.files.values():
+            f.flush()
+            os.fsync(f.fileno())
+        sizes = self.sizes()
+        write_journal([{'person_id': person_id, 'declarations': declarations, 'sizes': sizes}
+                       for person_id, declarations in self.done])
+        self.done = []
+
+    def close(self):
+        self.checkpoint()
+        for f in self.files.values():
+            f.close()
+        # the previous declarations.tsv is still in place to take the removed rows from
+        if CHANGES_FILE:
+            write_changes(TSV_FILE, TSV_FILE + '.part')
+        for key, f in self.files.items():
+            os.replace(f.name, output_files()[key])
+        if self.database is not None:
+            self.database.close()
+        if self.archive is not None:
+            self.archive.close()
+            if self.archive.file_name.endswith('.part'):
+                archive_file = self.archive.file_name[:-len('.part')]
+                remove_database(archive_file)
+                os.replace(self.archive.file_name, archive_file)
+
+
+def sql_column(field):
+    return '"' + field.replace('/', '_') + '"'
+
+
+SQLITE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS deputies (
+    person_id TEXT PRIMARY KEY,
+    name TEXT,
+    href TEXT,
+    convocations TEXT
+);
+CREATE TABLE IF NOT EXISTS declarations (
+    id INTEGER PRIMARY KEY,
+    person_id TEXT REFERENCES deputies (person_id),
+    href TEXT,
+    declaration_year TEXT,
+    source_type TEXT,
+    status TEXT,
+    rows_hash TEXT,
+    UNIQUE (person_id, href)
+);
+CREATE TABLE IF NOT EXISTS declaration_items (
+    id INTEGER PRIMARY KEY,
+    declaration_id INTEGER REFERENCES declarations (id),
+    %s
+);
+CREATE INDEX IF NOT EXISTS declaration_items_person_year ON declaration_items (person, declaration_year);
+CREATE INDEX IF NOT EXISTS declaration_items_section ON declaration_items (decl_section);
+CREATE INDEX IF NOT EXISTS declaration_items_point_title ON declaration_items (point_title);
+CREATE INDEX IF NOT EXISTS declaration_items_declaration ON declaration_items (declaration_id);
+CREATE INDEX IF NOT EXISTS declarations_person_year ON declarations (person_id, declaration_year);
+''' % ',\n    '.join(sql_column(field) + ' TEXT' for field in FIELDS)
+
+
+class SQLiteSink(object):
+    '''
+    SQLite copy of the results: deputies, their declarations and declaration items (the rows of declarations.tsv).
+    Used by the main thread only; changes are committed in one transaction per checkpoint.
+    Writing a declaration again replaces its items, so resumed runs don't make duplicates
+    '''
+
+    def __init__(self, file_name, fresh=False):
+        self.connection = sqlite3.connect(file_name)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        if fresh:
+            self.connection.executescript('DROP TABLE IF EXISTS declaration_items; DROP TABLE IF EXISTS declarations; '
+                                          'DROP TABLE IF EXISTS deputies;')
+        self.connection.executescript(SQLITE_SCHEMA)
+        # databases made before deputies were tagged by convocation and declarations were hashed
+        for table, column in (('deputies', 'convocations'), ('declarations', 'rows_hash')):
+            if column not in [info[1] for info in self.connection.execute('PRAGMA table_info(%s)' % table)]:
+                self.connection.execute('ALTER TABLE %s ADD COLUMN %s TEXT' % (table, column))
+        self.insert_item = 'INSERT INTO declaration_items (declaration_id, %s) VALUES (?%s)' % (
+            ', '.join(sql_column(field) for field in FIELDS), ', ?' * len(FIELDS))
+
+    def write_deputies(self, people_list):
+        self.connection.executemany(
+            'INSERT INTO deputies (person_id, href, name, convocations) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (person_id) DO UPDATE SET href = excluded.href, name = excluded.name, '
+            'convocations = excluded.convocations',
+            [(person_id, person[0], person[1], ';'.join(person[2])) for person_id, person in people_list.items()])
+
+    def write_declarations(self, person_id, declarations, rows_by_href):
+        '''
+        declarations - [href, year, status] from crawl_person(), rows_by_href - parsed rows of data declarations
+        '''
+        for href, year, status in declarations:
+            source_type = 'pdf' if 'GetFile' in href else 'data'
+            self.connection.execute(
+                'INSERT INTO declarations (person_id, href, declaration_year, source_type, status) '
+                'VALUES (?, ?, ?, ?, ?) ON CONFLICT (person_id, href) DO UPDATE SET '
+                'declaration_year = excluded.declaration_year, status = excluded.status',
+                (person_id, href, year, source_type, status))
+            if href not in rows_by_href:
+                continue
+            rows_hash = hash_rows(rows_by_href[href]).hexdigest()
+            declaration_id, old_hash = self.connection.execute(
+                'SELECT id, rows_hash FROM declarations WHERE person_id = ? AND href = ?', (person_id, href)).fetchone()
+            # items of an unchanged declaration are not written again
+            if rows_hash == old_hash:
+                continue
+            self.connection.execute('DELETE FROM declaration_items WHERE declaration_id = ?', (declaration_id,))
+            self.connection.executemany(self.insert_item, [
+                [declaration_id] + list(row) + [''] * (len(FIELDS) - len(row)) for row in rows_by_href[href]])
+            self.connection.execute('UPDATE declarations SET rows_hash = ? WHERE id = ?', (rows_hash, declaration_id))
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+
+class PageArchive(object):
+    '''
+    Raw declaration pages, zlib-compressed, in one SQLite file indexed by the deputy and the declaration link.
+    Pages keep the order they were first archived in, which is the order of their rows in declarations.tsv
+    '''
+    SCHEMA = ('CREATE TABLE IF NOT EXISTS pages (person_id TEXT, href TEXT, person_name TEXT, '
+              'declaration_year TEXT, page BLOB, PRIMARY KEY (person_id, href))')
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.connection = sqlite3.connect(file_name)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(self.SCHEMA)
+        keys = [column[1] for column in self.connection.execute('PRAGMA table_info(pages)') if column[5]]
+        if keys == ['href']:
+            # archives of the older versions were keyed by the link only, several deputies share links
+            with self.connection:
+                self.connection.execute('ALTER TABLE pages RENAME TO pages_by_href')
+                self.connection.execute(self.SCHEMA)
+                self.connection.execute('INSERT INTO pages (person_id, href, person_name, declaration_year, page) '
+                                        'SELECT person_id, href, person_name, declaration_year, page '
+                                        'FROM pages_by_href ORDER BY rowid')
+                self.connection.execute('DROP TABLE pages_by_href')
+
+    def put(self, person_id, person_name, href, year, page):
+        self.connection.execute(
+            'INSERT INTO pages (person_id, href, person_name, declaration_year, page) VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT (person_id, href) DO UPDATE SET person_name = excluded.person_name, '
+            'declaration_year = excluded.declaration_year, page = excluded.page',
+            (person_id, href, person_name, year, zlib.compress(page)))
+
+    def pages(self):
+        '''
+        Yields (person_id, person_name, href, year, compressed page) in the archive order
+        '''
+        for entry in self.connection.execute('SELECT person_id, person_name, href, declaration_year, page '
+                                             'FROM pages ORDER BY rowid'):
+            yield entry
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+
+class PreviewIndex(object):
+    '''
+    {person_id: {'hash': sha1 of the preview page, 'declarations': [[href, year], ...]}} kept in INDEX_FILE
+    between runs. A preview page with the known hash is not parsed again.
+    In a distributed crawl the workers only read the index, the coordinator updates and saves it
+    '''
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.entries = {}
+        self.lock = threading.Lock()
+        if os.path.exists(file_name):
+            with open(file_name, encoding='utf-8') as f:
+                self.entries = json.load(f)
+
+    def declarations(self, person_id, page):
+        '''
+        Returns [[href, year], ...] of the preview page, from the index if the page has not changed
+        '''
+        page_hash = hashlib.sha1(page).hexdigest()
+        with self.lock:
+            entry = self.entries.get(person_id)
+        if entry is not None and entry['hash'] == page_hash:
+            return [list(declaration) for declaration in entry['declarations']]
+        declarations = get_declarations(page)
+        with self.lock:
+            self.entries[person_id] = {'hash': page_hash, 'declarations': declarations}
+        return [list(declaration) for declaration in declarations]
+
+    def get(self, person_id):
+        with self.lock:
+            return self.entries.get(person_id)
+
+    def update(self, person_id, entry):
+        with self.lock:
+            self.entries[person_id] = entry
+
+    def save(self):
+        with self.lock:
+            tmp = '%s.%d.part' % (self.file_name, os.getpid())
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f, ensure_ascii=False)
+            os.replace(tmp, self.file_name)
+
+
+class WorkQueue(object):
+    '''
+    Deputies of the distributed crawl in a SQLite file shared by the coordinator and the workers.
+    A worker leases deputies for LEASE_SECONDS, renews the leases while it crawls them and completes them
+    with their results; a deputy whose lease has expired is leased again by another worker,
+    after LEASE_ATTEMPTS leases it is given up as failed
+    '''
+
+    def __init__(self, file_name):
+        self.connection = sqlite3.connect(file_name, timeout=60, isolation_level=None)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS items (person_id TEXT PRIMARY KEY, person_name TEXT, '
+                                'state TEXT, worker TEXT, lease_until REAL, attempts INTEGER, result BLOB)')
+
+    @contextlib.contextmanager
+    def transaction(self):
+        # the write lock is taken at once, so two workers never lease the same deputy
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        self.connection.execute('COMMIT')
+
+    def seed(self, people_list):
+        '''
+        Replaces the queue with the deputies of people_list, in its order
+        '''
+        with self.transaction():
+            self.connection.execute('DELETE FROM items')
+            self.connection.executemany(
+                "INSERT INTO items (person_id, person_name, state, attempts) VALUES (?, ?, 'pending', 0)",
+                [(person_id, person[1]) for person_id, person in people_list.items()])
+
+    def expire(self):
+        '''
+        Gives up the deputies whose last lease has expired
+        '''
+        self.connection.execute("UPDATE items SET state = 'failed' WHERE state = 'leased' AND lease_until < ? "
+                                "AND attempts >= ?", (time.time(), LEASE_ATTEMPTS))
+
+    def lease(self, worker, count=1):
+        '''
+        Leases up to count pending deputies or deputies with expired leases. Returns [(person_id, person_name), ...]
+        '''
+        now = time.time()
+        with self.transaction():
+            self.expire()
+            items = self.connection.execute(
+                "SELECT person_id, person_name FROM items WHERE state = 'pending' "
+                "OR state = 'leased' AND lease_until < ? ORDER BY rowid LIMIT ?", (now, count)).fetchall()
+            self.connection.executemany(
+                "UPDATE items SET state = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1 "
+                "WHERE person_id = ?", [(worker, now + LEASE_SECONDS, person_id) for person_id, person_name in items])
+        return items
+
+    def renew(self, worker):
+        '''
+        Extends the leases of the deputies worker is crawling by LEASE_SECONDS
+        '''
+        self.connection.execute("UPDATE items SET lease_until = ? WHERE worker = ? AND state = 'leased'",
+                                (time.time() + LEASE_SECONDS, worker))
+
+    def complete(self, person_id, worker, result):
+        '''
+        Stores the result of the deputy leased by worker. Returns False if the deputy is leased by another worker
+        '''
+        cursor = self.connection.execute(
+            "UPDATE items SET state = 'done', result = ? WHERE person_id = ? AND worker = ? "
+            "AND state IN ('leased', 'failed')",
+            (zlib.compress(json.dumps(result, ensure_ascii=False).encode('utf-8')), person_id, worker))
+        return cursor.rowcount == 1
+
+    def items(self):
+        '''
+        Returns [(person_id, person_name), ...] in the queue order
+        '''
+        return self.connection.execute('SELECT person_id, person_name FROM items ORDER BY rowid').fetchall()
+
+    def result(self, person_id):
+        '''
+        Returns the state of the deputy and the result if it is done
+        '''
+        state, result = self.connection.execute('SELECT state, result FROM items WHERE person_id = ?',
+                                                (person_id,)).fetchone()
+        return state, json.loads(zlib.decompress(result).decode('utf-8')) if result is not None else None
+
+    def counts(self):
+        return dict(self.connection.execute('SELECT state, COUNT(*) FROM items GROUP BY state'))
+
+    def close(self):
+        self.connection.close()
+
+
+def remove_database(file_name):
+    '''
+    Removes SQLite database with its WAL files
+    '''
+    for suffix in ('', '-wal', '-shm'):
+        try:
+            os.remove(file_name + suffix)
+        except OSError:
+            pass
+
+
+def open_archive(fresh, resume=False):
+    '''
+    Opens PageArchive of the run. A fresh run writes ARCHIVE_FILE.part which replaces the archive when the run
+    is complete, so the pages of deputies and declarations no longer crawled are dropped;
+    incremental runs add pages to ARCHIVE_FILE
+    '''
+    if not ARCHIVE_FILE:
+        return None
+    part = ARCHIVE_FILE + '.part'
+    if not fresh or resume and not os.path.exists(part):
+        return PageArchive(ARCHIVE_FILE)
+    if not resume:
+        remove_database(part)
+    return PageArchive(part)
+
+
+def read_journal():
+    '''
+    Returns the list of checkpoint records. A record is written for the start of every run
+    and for every deputy whose results are already in the output files
+    '''
+    records = []
+    try:
+        with open(JOURNAL_FILE, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # the last line may be half-written if the script was killed
+                    break
+    except IOError:
+        pass
+    return records
+
+
+def write_journal(records, mode='a'):
+    with open(JOURNAL_FILE, mode, encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
 
 
 def get_person_id(href):
@@ -69,30 +1175,180 @@ def get_person_id(href):
     return href.split('/')[-1]
 
 
-def get_page(fetch_address):
+def get_page(fetch_address, timeout=None):
     '''
-    Fetches the url
+    Fetches the url using the shared keep-alive SESSION.
+    Fresh pages are taken from CACHE, stale ones are revalidated with ETag/Last-Modified
+    and returned as they are when the server keeps failing.
+    Requests are paced by SCHEDULER, failed ones are retried up to RETRIES times for every kind of failure.
+    Every call is recorded in METRICS
     '''
     print(fetch_address)
-    attempts = 0
-    while (TRIES - attempts) > 1:
-        attempts += 1
-        req = urllib.request.Request(fetch_address, None)
+    started = time.time()
+    info = {'cache': 'miss', 'status': '', 'retries': 0}
+    body = None
+    try:
+        body = fetch_page(fetch_address, timeout, info)
+        return body
+    finally:
+        METRICS.request(fetch_address, time.time() - started, len(body) if body is not None else 0, info)
+
+
+def fetch_page(fetch_address, timeout, info):
+    entry, cached_body = CACHE.get(fetch_address)
+    if CACHE_ONLY or (entry is not None and is_fresh(entry)):
+        info['cache'] = 'hit' if entry is not None else 'offline_miss'
+        return cached_body
+    request_headers = validators(entry) if entry is not None else None
+
+    bucket = SCHEDULER.bucket(fetch_address)
+    failures = {}
+    while True:
+        bucket.acquire()
         try:
-            response = urllib.request.urlopen(req)
-        except IOError:
-            time.sleep(SLEEP_TIME)
-        except Exception:
-            time.sleep(SLEEP_TIME)
+            status, headers, body = SESSION.request(fetch_address, headers=request_headers, timeout=timeout)
+        except Exception as error:
+            failure = failure_class(error)
+            info['status'] = getattr(error, 'code', failure)
+            bucket.failed(failure in ('timeout', 'server', 'reset'))
+            failures[failure] = failures.get(failure, 0) + 1
+            if failures[failure] > RETRIES.get(failure, 0):
+                # the stale page is still better than none
+                if entry is not None:
+                    info['cache'] = 'stale'
+                    return cached_body
+                return None
+            info['retries'] += 1
+            time.sleep(backoff(sum(failures.values()) - 1, error))
+        else:
+            bucket.succeeded()
+            break
+
+    info['status'] = status
+    if status == 304:
+        info['cache'] = 'revalidated'
+        CACHE.refresh(fetch_address)
+        return cached_body
+    CACHE.put(fetch_address, headers, body)
+    return body
+
+
+def download_file(url, file_name, timeout=None):
+    '''
+    Streams the url to file_name by DOWNLOAD_CHUNK_SIZE chunks, never holding the whole file in memory.
+    The body goes to file_name + '.part' first; a part left by a broken download is continued with a Range request.
+    An existing file is kept when its size (and MD5, if the server sends Content-MD5) matches the server's one.
+    Requests are paced and retried like in get_page(). Returns True when the file is in place
+    '''
+    print(url)
+    started = time.time()
+    info = {'cache': 'miss', 'status': '', 'retries': 0, 'bytes': 0}
+    try:
+        # two downloads of one file must not write its part file at once
+        with file_lock(file_name):
+            return fetch_file(url, file_name, timeout, info)
+    finally:
+        METRICS.request(url, time.time() - started, info['bytes'], info)
+
+
+def file_lock(file_name):
+    with FILE_LOCKS_GUARD:
+        return FILE_LOCKS.setdefault(file_name, threading.Lock())
+
+
+def fetch_file(url, file_name, timeout, info):
+    if os.path.exists(file_name):
+        if CACHE_ONLY or file_matches(url, file_name, timeout, info):
+            info['cache'] = 'hit'
+            return True
+    if CACHE_ONLY:
+        info['cache'] = 'offline_miss'
+        return False
+
+    bucket = SCHEDULER.bucket(url)
+    failures = {}
+    while True:
+        bucket.acquire()
+        try:
+            stream_to_file(url, file_name + '.part', timeout, info)
+        except Exception as error:
+            failure = failure_class(error)
+            info['status'] = getattr(error, 'code', failure)
+            bucket.failed(failure in ('timeout', 'server', 'reset'))
+            failures[failure] = failures.get(failure, 0) + 1
+            if failures[failure] > RETRIES.get(failure, 0):
+                return False
+            info['retries'] += 1
+            time.sleep(backoff(sum(failures.values()) - 1, error))
         else:
-            return response.read()
-    return None
+            bucket.succeeded()
+            break
+    os.replace(file_name + '.part', file_name)
+    return True
+
+
+def file_matches(url, file_name, timeout, info):
+    '''
+    Asks the server for the file size with HEAD request and compares it with the downloaded file.
+    The file is trusted when the server does not answer
+    '''
+    SCHEDULER.bucket(url).acquire()
+    try:
+        with SESSION.stream(url, timeout=timeout, method='HEAD') as response:
+            info['status'] = response.status
+            length = response.headers.get('Content-Length')
+            md5 = response.headers.get('Content-MD5')
+    except Exception:
+        return True
+    if length is not None and int(length) != os.path.getsize(file_name):
+        return False
+    return md5 is None or base64.b64decode(md5) == file_hash(file_name)
+
+
+def file_hash(file_name):
+    md5 = hashlib.md5()
+    with open(file_name, 'rb') as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+            md5.update(chunk)
+    return md5.digest()
+
+
+def stream_to_file(url, part_file, timeout, info):
+    '''
+    Downloads the url to part_file, continuing it from its current size.
+    Raises an exception when the body is shorter than the server has promised
+    '''
+    offset = os.path.getsize(part_file) if os.path.exists(part_file) else 0
+    headers = {'Range': 'bytes=%d-' % offset} if offset else None
+    try:
+        with SESSION.stream(url, headers=headers, timeout=timeout) as response:
+            info['status'] = response.status
+            if response.status == 206:
+                total = response.headers.get('Content-Range', '').rpartition('/')[2]
+            else:
+                # the server ignored Range and sends the whole file
+                offset = 0
+                total = response.headers.get('Content-Length')
+            with open(part_file, 'ab' if offset else 'wb') as f:
+                for chunk in iter(lambda: response.read(DOWNLOAD_CHUNK_SIZE), b''):
+                    f.write(chunk)
+                    info['bytes'] += len(chunk)
+    except urllib.error.HTTPError as error:
+        # the part does not fit the file on the server any more, download it from scratch
+        if error.code == 416 and offset:
+            os.remove(part_file)
+            return stream_to_file(url, part_file, timeout, info)
+        raise
+    if total and total.isdigit() and os.path.getsize(part_file) != int(total):
+        raise http.client.IncompleteRead(b'', int(total) - os.path.getsize(part_file))
 
 
 def get_people(url):
     '''
     Takes link on the page with deputies list and returns dictionary {id_person:link on deputy page, deputy's name}
     '''
+    from pyquery import PyQuery as pq
+
     list_of_dep = {}
     page = get_page(url)
 
@@ -101,7 +1357,7 @@ def get_people(url):
         links = pageq("a[target='_blank']")
         print('Total links found: ', len(links))
     else:
-        print("Can't get a list of deputies after " + str(TRIES) + " attempt(s). Possible, www.rada.gov.ua is not callable")
+        print("Can't get a list of deputies. Possible, www.rada.gov.ua is not callable")
         return {}
 
     for link in links:
@@ -113,6 +1369,39 @@ def get_people(url):
     return list_of_dep
 
 
+def get_convocation(url):
+    '''
+    Gets convocation (skl_id) from the link on the deputies list
+    '''
+    return urllib.parse.parse_qs(urllib.parse.urlsplit(url).query).get('skl_id', [''])[0]
+
+
+def get_all_people(urls):
+    '''
+    Fetches deputies lists of several convocations at once and merges them by get_person_id(),
+    so a deputy of several convocations is crawled once.
+    Returns dictionary {id_person: [link on deputy page, deputy's name, [convocations]]} in the order of urls
+    '''
+    with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+        lists = list(executor.map(get_people, urls))
+    people_list = {}
+    for url, list_of_dep in zip(urls, lists):
+        for person_id, (href, deputy_name) in list_of_dep.items():
+            people_list.setdefault(person_id, [href, deputy_name, []])[2].append(get_convocation(url))
+    return people_list
+
+
+def write_deputies_file(people_list):
+    '''
+    Writes DEPUTIES_FILE: person id, name and convocations (joined with ';') of every deputy of the run
+    '''
+    with open(DEPUTIES_FILE + '.part', 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        for person_id, person in people_list.items():
+            writer.writerow([person_id, person[1], ';'.join(person[2])])
+    os.replace(DEPUTIES_FILE + '.part', DEPUTIES_FILE)
+
+
 def get_dec_year(dec_description):
     '''
     Takes string with daclaration's description and returns delaration's year
@@ -124,474 +1413,1426 @@ def get_dec_file_name(person_name, year):
     return person_name.split(' ')[0].replace("'", "") + '_' + person_name.split(' ')[1][0] + person_name.split(' ')[2][0] + '_' + year + '.pdf'
 
 
+def get_pdf_file_name(person_id, person_name, href, year):
+    '''
+    File name of PDF declaration, unique in the run: namesakes and several declarations of a year
+    get the link id and then the person id appended. Returns None if the name is not of three words
+    '''
+    from unidecode import unidecode
+    try:
+        file_name = get_dec_file_name(unidecode(person_name), year)[:-len('.pdf')]
+    except IndexError:
+        return None
+    link_id = href.split('/')[-1]
+    owner = (person_id, href)
+    with FILE_LOCKS_GUARD:
+        for name in (file_name, file_name + '_' + link_id, file_name + '_' + person_id + '_' + link_id):
+            if PDF_FILE_NAMES.setdefault(name + '.pdf', owner) == owner:
+                return name + '.pdf'
+
+
 def complete_content(p):
     '''
     Makes up string. Deletes tags, \r, \n.
+    Walks the string with indexes instead of slicing it, so a cell is read once
     '''
     res = list()
-    while '<' in p and p[:p.find('<')]:
-        new_string = p[:p.find('<')].strip('\r\n').replace('\r\n', '')
-        res.append(new_string)
-        p = p[p.find('>') + 1:]
+    start = 0
+    while True:
+        tag_start = p.find('<', start)
+        # stop when there are no more tags or no text before the next tag
+        if tag_start <= start:
+            break
+        res.append(p[start:tag_start].strip('\r\n').replace('\r\n', ''))
+        tag_end = p.find('>', start)
+        if tag_end < 0:
+            break
+        start = tag_end + 1
     return res
 
 
-def write_decl_row(row_dict, writer):
-    # check for empty content
-    if row_dict['point_title'] != '':
-        row = []
-        for field in FIELDS:
-            if field in row_dict:
-                row.append(row_dict[field])
-            else:
-                row.append("")
+def decode_page(page):
+    '''
+    Decodes page bytes: charset from meta tag, utf-8 or ENCODING
+    '''
+    match = re.search(b'<meta[^>]+charset=["\']?([\\w-]+)', page[:2048], re.I)
+    encodings = ([match.group(1).decode('ascii')] if match else []) + ['utf-8', ENCODING]
+    for encoding in encodings:
+        try:
+            return page.decode(encoding)
+        except (UnicodeDecodeError, LookupError):
+            pass
+    return page.decode(ENCODING, 'replace')
 
-        writer.writerow(row)
 
+def escape_text(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
 
-def write_decl_rows(rows, writer):
-    for row in rows:
-        write_decl_row(row, writer)
 
+def collapse_whitespace(text, preserve=False):
+    '''
+    BeautifulSoup keeps a whitespace-only string as a single newline or space
+    '''
+    if text and not preserve and not text.strip(ASCII_SPACES):
+        return '\n' if '\n' in text else ' '
+    return text
 
-def parse_decl(page, person_name, year):
-    res = list()
-    soup = BeautifulSoup(page)
-    declaration_div = soup.find('div', id="declaration")
-    section_headers = declaration_div.findAll('h3', recursive=False)
-    sections = declaration_div.findAll('div', recursive=False)
 
-    filehandler = codecs.open(TSV_FILE, 'a', encoding='utf-8')
-    writer = csv.writer(filehandler, delimiter='\t')
+def serialize_attribute(name, value):
+    '''
+    Writes attribute the way BeautifulSoup does
+    '''
+    value = escape_text(value)
+    if '"' in value:
+        if "'" in value:
+            return ' %s="%s"' % (name, value.replace('"', '&quot;'))
+        return " %s='%s'" % (name, value)
+    return ' %s="%s"' % (name, value)
+
+
+def serialize_contents(element, parts, preserve=False):
+    comment = import_lxml().etree.Comment
+    if element.text:
+        parts.append(escape_text(collapse_whitespace(element.text, preserve)))
+    for child in element:
+        if child.tag is comment:
+            parts.append('<!--' + (child.text or '') + '-->')
+        elif isinstance(child.tag, str):
+            parts.append('<' + child.tag)
+            for name, value in child.attrib.items():
+                parts.append(serialize_attribute(name, value))
+            if child.tag in VOID_ELEMENTS:
+                parts.append('/>')
+            else:
+                parts.append('>')
+                serialize_contents(child, parts, preserve or child.tag in PRESERVE_WHITESPACE)
+                parts.append('</' + child.tag + '>')
+        if child.tail:
+            parts.append(escape_text(collapse_whitespace(child.tail, preserve)))
+
+
+def iter_strings(element, preserve=False):
+    if element.text:
+        yield collapse_whitespace(element.text, preserve)
+    for child in element:
+        if isinstance(child.tag, str):
+            for string in iter_strings(child, preserve or child.tag in PRESERVE_WHITESPACE):
+                yield string
+        if child.tail:
+            yield collapse_whitespace(child.tail, preserve)
+
 
-    # ------------- Parse section I -------------
-    family_tab = sections[0].find('table')
+def match_attribute(value, pattern):
+    if value is None:
+        return False
+    if hasattr(pattern, 'search'):
+        return pattern.search(value) is not None
+    return value == pattern
 
-    n = 0
-    for i in family_tab.findAll('td'):
-        n += 1
-        if n % 2 == 1:
-            # remember name
-            rel_title = i.decode_contents()
+
+class LxmlNode(object):
+    '''
+    Wraps lxml element into the part of BeautifulSoup API used by parse_decl() and main().
+    Serialized contents are kept, so decode_contents() of a cell is computed once
+    '''
+    __slots__ = ('element', 'contents')
+
+    def __init__(self, element):
+        self.element = element
+        self.contents = None
+
+    @property
+    def attrs(self):
+        return dict(self.element.attrib)
+
+    def __getitem__(self, key):
+        return self.element.attrib[key]
+
+    @property
+    def string(self):
+        element = self.element
+        children = len(element) + sum(1 for child in element if child.tail)
+        if element.text:
+            return collapse_whitespace(element.text, element.tag in PRESERVE_WHITESPACE) if not children else None
+        if children == 1 and not element[0].tail:
+            if element[0].tag is import_lxml().etree.Comment:
+                return element[0].text
+            if isinstance(element[0].tag, str):
+                return LxmlNode(element[0]).string
+        return None
+
+    def find(self, name, recursive=True, **attrs):
+        found = self.findAll(name, recursive, limit=1, **attrs)
+        return found[0] if found else None
+
+    def findAll(self, name, recursive=True, limit=None, **attrs):
+        if recursive:
+            elements = self.element.iterdescendants(name)
         else:
-            # form the row
-            rel_name = i.decode_contents()
-            row = dict()
-            row['person'] = person_name
-            row['declaration_year'] = year
-            row['point_title'] = 'Член сім`ї декларанта'
-            row['content'] = rel_title + ', ' + rel_name
-            row['decl_section'] = section_headers[0].decode_contents()
-            write_decl_row(row, writer)
-
-    # ------------- Parse section II -------------
-    income_tables = sections[1].findAll('table')
-
-    # Section II.A
-    row = dict()
-    row['person'] = person_name
-    row['declaration_year'] = year
-    row['decl_section'] = section_headers[1].decode_contents()
+            elements = self.element.iterchildren(name)
+        res = []
+        for element in elements:
+            if all(match_attribute(element.get(key), pattern) for key, pattern in attrs.items()):
+                res.append(LxmlNode(element))
+                if limit and len(res) >= limit:
+                    break
+        return res
+
+    def get_text(self):
+        return ''.join(iter_strings(self.element, self.element.tag in PRESERVE_WHITESPACE))
+
+    def decode_contents(self):
+        if self.contents is None:
+            parts = []
+            serialize_contents(self.element, parts, self.element.tag in PRESERVE_WHITESPACE)
+            self.contents = ''.join(parts)
+        return self.contents
+
+
+@lru_cache(maxsize=None)
+def import_lxml():
+    '''
+    Imports lxml on the first call. Returns the package, or None when it is not installed
+    '''
+    try:
+        import lxml.html
+        import lxml.etree
+    except ImportError:
+        return None
+    return lxml
+
+
+def make_soup(page, parser=None):
+    '''
+    Parses the page with PARSER engine. Both engines give the same tree API, lxml is used when it is installed
+    '''
+    lxml = import_lxml()
+    parser = parser or PARSER
+    if parser in ('lxml', 'stream') and lxml is not None:
+        text = decode_page(page)
+        html_parser = lxml.html.HTMLParser(encoding='utf-8')
+        return LxmlNode(lxml.html.document_fromstring(text.encode('utf-8'), parser=html_parser))
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(page, 'lxml' if lxml is not None else 'html.parser')
+
+
+# Positions of the fields changed after a row is made
+POINT_TITLE = FIELDS.index('point_title')
+ADDITIONAL_INFORMATION = FIELDS.index('additional_information')
+
+
+class DeclRow(object):
+    '''
+    Row of a declaration section being parsed, one slot for every field of FIELDS ('declarer/family'
+    is declarer_family). person, declaration_year and decl_section are set once for the section,
+    the other slots are overwritten for every row
+    '''
+    __slots__ = tuple(field.replace('/', '_') for field in FIELDS)
+    get_values = operator.attrgetter(*__slots__)
+
+    def __init__(self, person, year, decl_section):
+        for slot in self.__slots__:
+            setattr(self, slot, '')
+        self.person = person
+        self.declaration_year = year
+        self.decl_section = decl_section
+
+    def values(self):
+        '''
+        Returns the row as list in FIELDS order
+        '''
+        return list(self.get_values(self))
+
+    def emit(self):
+        '''
+        Returns the row to yield, nothing when it has empty point_title
+        '''
+        if self.point_title != '':
+            return (self.values(),)
+        return ()
+
+
+def feed_rows(rows, *writers):
+    '''
+    Passes every row to all writers (csv writers or any objects with writerow()) in one pass
+    '''
+    for row in rows:
+        for writer in writers:
+            writer.writerow(row)
+
+
+def read_decl_rows(tsv_file=None):
+    '''
+    Reads rows written by OutputSink back from TSV_FILE, skips the header
+    '''
+    with open(tsv_file or TSV_FILE, encoding='utf-8', newline='') as f:
+        reader = csv.reader(f, delimiter='\t')
+        for row in reader:
+            if row[:len(FIELDS)] == FIELDS:
+                continue
+            yield row
+
+
+BLOCK_FIELDS = [FIELDS.index(field) for field in ('person', 'declaration_year', 'decl_section')]
+
+
+def block_key(row):
+    return '\t'.join(row[n] for n in BLOCK_FIELDS)
+
+
+def hash_rows(rows, digest=None):
+    digest = digest or hashlib.sha1()
+    for row in rows:
+        digest.update(('\t'.join(row) + '\n').encode('utf-8'))
+    return digest
+
+
+def hash_blocks(rows):
+    '''
+    Returns {block key: sha1 of the block rows} in the order the blocks appear
+    '''
+    digests = {}
+    for row in rows:
+        if len(row) < len(FIELDS):
+            continue
+        key = block_key(row)
+        if key not in digests:
+            digests[key] = hashlib.sha1()
+        hash_rows([row], digests[key])
+    return dict((key, digest.hexdigest()) for key, digest in digests.items())
+
+
+def block_rows(rows, keys):
+    '''
+    Returns {block key: rows} for the blocks in keys
+    '''
+    blocks = {}
+    for row in rows:
+        if len(row) >= len(FIELDS) and block_key(row) in keys:
+            blocks.setdefault(block_key(row), []).append(row)
+    return blocks
+
+
+def subtract_rows(rows, other):
+    '''
+    Rows which are not in other, every row of other cancels one equal row
+    '''
+    counts = {}
+    for row in other:
+        counts[tuple(row)] = counts.get(tuple(row), 0) + 1
+    res = []
+    for row in rows:
+        if counts.get(tuple(row)):
+            counts[tuple(row)] -= 1
+        else:
+            res.append(row)
+    return res
+
+
+def write_changes(old_tsv, new_tsv):
+    '''
+    Compares the blocks of new_tsv with BLOCKS_FILE of the previous run (or with old_tsv if there is no index),
+    writes the changed blocks to CHANGES_FILE and the new index to BLOCKS_FILE.
+    Only the rows of changed blocks are held in memory. Returns the number of changed blocks
+    '''
+    if os.path.exists(BLOCKS_FILE):
+        with open(BLOCKS_FILE, encoding='utf-8') as f:
+            old_index = json.load(f)
+    elif os.path.exists(old_tsv):
+        old_index = hash_blocks(read_decl_rows(old_tsv))
+    else:
+        old_index = {}
+    new_index = hash_blocks(read_decl_rows(new_tsv))
+    changed = [key for key, block_hash in new_index.items() if old_index.get(key) != block_hash]
+    changed += [key for key in old_index if key not in new_index]
+
+    keys = set(changed)
+    old_blocks = block_rows(read_decl_rows(old_tsv), keys) if keys and os.path.exists(old_tsv) else {}
+    new_blocks = block_rows(read_decl_rows(new_tsv), keys) if keys else {}
+    with open(CHANGES_FILE + '.part', 'w', encoding='utf-8') as f:
+        for key in changed:
+            person, year, section = key.split('\t')
+            old_rows = old_blocks.get(key, [])
+            new_rows = new_blocks.get(key, [])
+            change = 'added' if key not in old_index else 'removed' if key not in new_index else 'modified'
+            f.write(json.dumps({'change': change, 'person': person, 'declaration_year': year,
+                                'decl_section': section, 'added': subtract_rows(new_rows, old_rows),
+                                'removed': subtract_rows(old_rows, new_rows)}, ensure_ascii=False) + '\n')
+    with open(BLOCKS_FILE + '.part', 'w', encoding='utf-8') as f:
+        json.dump(new_index, f, ensure_ascii=False)
+    os.replace(CHANGES_FILE + '.part', CHANGES_FILE)
+    os.replace(BLOCKS_FILE + '.part', BLOCKS_FILE)
+    return len(changed)
+
 
+def parse_decimal(value):
+    '''
+    Turns sums like '96719,0' or '101 515 133 ' into Decimal, returns None for other text
+    '''
+    value = value.replace(' ', '').replace('\xa0', '')
+    if not NUMBER_RE.match(value):
+        return None
+    return decimal.Decimal(value.replace(',', '.')).quantize(decimal.Decimal(1).scaleb(-DECIMAL_SCALE))
+
+
+def parse_int(value):
+    value = value.strip()
+    return int(value) if value.isdigit() else None
+
+
+def export_schema():
+    import pyarrow as pa
+
+    types = {
+        'int': pa.int32(),
+        'decimal': pa.decimal128(DECIMAL_PRECISION, DECIMAL_SCALE),
+        'dictionary': pa.dictionary(pa.int32(), pa.string()),
+    }
+    fields = [pa.field(field, types.get(EXPORT_TYPES.get(field), pa.string())) for field in FIELDS]
+    fields.append(pa.field('content_value', types['decimal']))
+    return pa.schema(fields)
+
+
+def export_batch(rows, schema):
+    import pyarrow as pa
+
+    converters = {'int': parse_int, 'decimal': parse_decimal}
+    arrays = []
+    for n, field in enumerate(FIELDS):
+        kind = EXPORT_TYPES.get(field)
+        values = [row[n] if n < len(row) else '' for row in rows]
+        if kind in converters:
+            values = [converters[kind](value) for value in values]
+        if kind == 'dictionary':
+            arrays.append(pa.array(values, pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(values, schema.field(field).type))
+    content = FIELDS.index('content')
+    arrays.append(pa.array([parse_decimal(row[content]) for row in rows], schema.field('content_value').type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def export_batches(schema, tsv_file=None):
+    rows = []
+    for row in read_decl_rows(tsv_file):
+        rows.append(row)
+        if len(rows) >= EXPORT_BATCH_SIZE:
+            yield export_batch(rows, schema)
+            rows = []
+    if rows:
+        yield export_batch(rows, schema)
+
+
+def export_rows(export_file, tsv_file=None):
+    '''
+    Exports declarations.tsv to typed columnar file: Parquet, or Arrow IPC if export_file ends with .arrow.
+    Needs pyarrow
+    '''
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq_parquet
+    except ImportError:
+        sys.exit('Export needs pyarrow: pip install pyarrow')
+
+    schema = export_schema()
+    if export_file.endswith('.arrow'):
+        # Arrow file keeps one dictionary per column, so batches are unified before writing
+        table = pa.Table.from_batches(list(export_batches(schema, tsv_file)), schema).unify_dictionaries()
+        with pa.ipc.new_file(export_file, schema) as writer:
+            writer.write_table(table)
+    else:
+        with pq_parquet.ParquetWriter(export_file, schema) as writer:
+            for batch in export_batches(schema, tsv_file):
+                writer.write_batch(batch)
+
+
+def to_numbers(column):
+    '''
+    Turns pandas column of sums like '96719,0', '101 515 133 ' or ';'-joined lists of them into float64 column,
+    lists are summed. Other text gives NaN
+    '''
+    import pandas as pd
+
+    parts = column.str.split(';').explode().str.replace(r'[\s\xa0]', '', regex=True)
+    parts = parts.where(parts.str.match(NUMBER_RE.pattern)).str.replace(',', '.', regex=False)
+    return pd.to_numeric(parts).groupby(level=0).sum(min_count=1)
+
+
+def to_currency_codes(column):
+    import numpy as np
+
+    names = column.str.strip().str.lower()
+    codes = np.select([names.str.startswith(prefix) for prefix, code in CURRENCY_CODES],
+                      [code for prefix, code in CURRENCY_CODES], default='')
+    # numbers and 'назву валюти не зазначено' are not currencies
+    return column.str.strip().where(codes == '', codes).where(~names.str.match(r'^([\d\s.,]*|назву .*)$'), '')
+
+
+def load_rows(tsv_file=None):
+    '''
+    Loads declarations.tsv to pandas DataFrame. Adds section (I-VI), float columns <field>_value for
+    content and the sums, and currency with ISO code of Name_of_currency where it is known. Needs pandas
+    '''
+    import pandas as pd
+
+    frame = pd.read_csv(tsv_file or TSV_FILE, sep='\t', dtype=str, keep_default_na=False, usecols=FIELDS)
+    frame['section'] = frame['decl_section'].str.extract(r'^Розділ ([IVX]+)\.', expand=False).fillna('')
+    for field in ('content', 'Sum1_property', 'Sum2_leasing', 'Sum3_income_in_currency'):
+        frame[field + '_value'] = to_numbers(frame[field])
+    frame['currency'] = to_currency_codes(frame['Name_of_currency'])
+    return frame
+
+
+def summarize_rows(frame):
+    '''
+    Per deputy and year totals of load_rows() frame, by SUMMARY_COLUMNS
+    '''
+    keys = ['person', 'declaration_year']
+    summary = frame.groupby(keys, sort=False).size().rename('rows').to_frame()
+    for column, sections, field, pattern in SUMMARY_COLUMNS:
+        selected = frame[frame['section'].isin(sections) & frame['point_title'].str.match(pattern)]
+        summary[column] = selected.groupby(keys, sort=False)[field + '_value'].sum()
+    return summary.fillna(0).reset_index()
+
+
+def write_summary(summary_file=None, tsv_file=None):
+    '''
+    Writes the summary table of declarations.tsv to CSV file, or to Parquet file if summary_file ends with
+    .parquet, and to summary table of SQLITE_FILE if it is set. Needs pandas
+    '''
+    try:
+        import pandas as pd
+    except ImportError:
+        sys.exit('Summary needs pandas: pip install pandas')
+
+    summary_file = summary_file or SUMMARY_FILE
+    summary = summarize_rows(load_rows(tsv_file))
+    if summary_file.endswith('.parquet'):
+        summary.to_parquet(summary_file, index=False)
+    else:
+        summary.to_csv(summary_file, index=False)
+    if SQLITE_FILE:
+        with sqlite3.connect(SQLITE_FILE) as connection:
+            summary.to_sql('summary', connection, if_exists='replace', index=False)
+    print('%d deputy-years summarized to %s' % (len(summary), summary_file))
+
+
+def parse_decl(page, person_name, year, writer=None, parser=None, timings=None):
+    '''
+    Parses declaration page and writes its rows to TSV_FILE or to the given csv writer.
+    Parse time of every section is put to timings dictionary if it is given
+    '''
+    rows = iter_decl_rows(page, person_name, year, parser, timings)
+    if writer is not None:
+        feed_rows(rows, writer)
+        return
+    with codecs.open(TSV_FILE, 'a', encoding='utf-8') as filehandler:
+        feed_rows(rows, csv.writer(filehandler, delimiter='\t'))
+
+
+# ------------- Record rules of the declaration tables -------------
+# A rule gets the row of the table and one record (the <td> contents of a table row) and yields the rows to write.
+# The row keeps the values between the records of a table, additional_information too
+
+DIGITS_RE = re.compile(r'\d+')
+NUMBERS_RE = re.compile(r'\d+.*\d+')
+
+
+def family_rows(row, cells, option):
+    '''
+    Section I: relation, name
+    '''
+    if len(cells) < 2:
+        return
+    row.point_title = 'Член сім`ї декларанта'
+    row.content = cells[0] + ', ' + cells[1]
+    yield from row.emit()
+
+
+def income_rows(row, table, option):
+    '''
+    Section II.A, read by <tr>: income type, declarant's and family's sums. A note spanning the three columns
+    belongs to the row before it
+    '''
     rows = list()
-    trs = income_tables[0].findAll('tr')
-    for tr in trs:
+    for tr in table.findAll('tr'):
         tds = tr.findAll('td')
         if len(tds) == 3:
             income_type, personal_value, family_value = [
                 td.get_text() for td in tds
             ]
-            values_order = copy(VALUES_ORDER)
-            for value in (personal_value, family_value):
-                current_row = copy(row)
-                current_row['point_title'] = income_type
-                current_row['declarer/family'] = values_order.pop(0)
-                current_row['content'] = value
-                if not current_row['content'].isdigit():
-                    current_row['additional_information'] = current_row['content']
-                if current_row['content']:
-                    rows.append(current_row)
-        elif len(tds) == 1:
-            td = tds[0]
-            if 'colspan' in td.attrs and td.attrs['colspan'] == "3":
-                rows[-1]['additional_information'] = td.get_text()
-        else:
-            pass
-    write_decl_rows(rows, writer)
-
-    # Section II.B
-    n = 0
-    row['additional_information'] = ''
-    for i in income_tables[1].findAll('td'):
-        n += 1
-        if n % 3 == 1:
-            income_country = i.decode_contents()
-        elif n % 3 == 2:
-            currency_income = i.decode_contents()
-        else:
-            row['point_title'] = "Одержані (нараховані) з джерел за межами України"
-            row['declarer/family'] = "декларант"
-            row['content'] = i.decode_contents()
-            if not i.decode_contents().isdigit():
-                row['additional_information'] = i.decode_contents()
-            row['Name_of_country'] = income_country
-            try:
-                row['Name_of_currency'] = currency_income.split(' ')[1]
-            except IndexError:
-                row['Name_of_currency'] = 'назву валюти не зазначено'
-            row['Sum3_income_in_currency'] = currency_income.split(' ')[0]
-            if any([row['content'], row['Sum3_income_in_currency']]):
-                write_decl_row(row, writer)
-
-    # Section II.V
-    n = 0
-    row['additional_information'] = ''
-    for i in income_tables[2].findAll('td'):
-        n += 1
-        if n % 3 == 1:
-            income_country = i.decode_contents()
-        elif n % 3 == 2:
-            currency_income = i.decode_contents()
-        else:
-            row['point_title'] = "Одержані (нараховані) з джерел за межами України"
-            row['declarer/family'] = "сім'я"
-            row['content'] = i.decode_contents()
-            if not row['content']:
-                row['additional_information'] = i.decode_contents()
-            row['Name_of_country'] = income_country
-            try:
-                row['Name_of_currency'] = currency_income.split(' ')[1]
-            except IndexError:
-                row['Name_of_currency'] = 'назву валюти не зазначено'
-            row['Sum3_income_in_currency'] = currency_income.split(' ')[0]
-            if any([row['content'], row['Sum3_income_in_currency']]):
-                write_decl_row(row, writer)
-
-    # ------------- Parse section III -------------
-    realestate_tables = sections[2].findAll('table')
-    # Section III.A
-    row = dict()
-    row['person'] = person_name
-    row['declaration_year'] = year
-    row['decl_section'] = section_headers[2].decode_contents()
-    n = 0
-    for i in realestate_tables[0].findAll('td'):
-        n += 1
-        if n % 4 == 1:
-            realestate_type = i.decode_contents()
-        elif n % 4 == 2:
-            square = complete_content(i.decode_contents())
-        elif n % 4 == 3:
-            sum_property = complete_content(i.decode_contents())
-        else:
-            row['point_title'] = realestate_type
-            row['declarer/family'] = "декларант"
-            sum2_leasing = complete_content(i.decode_contents())
-            for e in range(len(square)):
-                row['content'] = square[e]
-                if not row['content'].isdigit():
-                    row['additional_information'] = row['content']
-                row['Sum1_property'] = sum_property[e]
-                row['Sum2_leasing'] = sum2_leasing[e]
-                if any([row['content'], row['Sum1_property'], row['Sum2_leasing']]):
-                    write_decl_row(row, writer)
-
-    # Section III.B
-    n = 0
-    row['additional_information'] = ''
-    row['Sum1_property'] = ''
-    row['Sum2_leasing'] = ''
-    for i in realestate_tables[1].findAll('td'):
-        n += 1
-        if n % 2 == 1:
-            realestate_type = i.decode_contents()
-        else:
-            row['point_title'] = realestate_type
-            row['declarer/family'] = "сім'я"
-            content = complete_content(i.decode_contents())
-            for item in content:
-                row['content'] = item
-                if not row['content'].isdigit():
-                    row['additional_information'] = row['content']
-                if row['content']:
-                    write_decl_row(row, writer)
-
-    # ------------- Parse section IV -------------
-    transport_tables = sections[3].findAll('table')
-
-    # Section IV.A
-    row = dict()
-    row['person'] = person_name
-    row['declaration_year'] = year
-    row['decl_section'] = section_headers[3].decode_contents()
-    n = 0
-    for i in transport_tables[0].findAll('td'):
-        n += 1
-        if n % 5 == 1:
-            transport_name = i.decode_contents()
-        elif n % 5 == 2:
-            transport_type = complete_content(i.decode_contents())
-        elif n % 5 == 3:
-            transport_year = complete_content(i.decode_contents())
-        elif n % 5 == 4:
-            sum_property = complete_content(i.decode_contents())
-        else:
-            row['point_title'] = transport_name
-            row['declarer/family'] = "декларант"
-            sum2_leasing = complete_content(i.decode_contents())
-            content = [transport_type[i] + ', ' + transport_year[i] +
-                       'р.в.' for i in range(0, len(transport_type))]
-            for e in range(len(content)):
-                row['content'] = content[e].strip()
-                row['Sum1_property'] = sum_property[e]
-                row['Sum2_leasing'] = sum2_leasing[e]
-                if any([row['content'], row['Sum1_property'], row['Sum2_leasing']]):
-                    write_decl_row(row, writer)
-
-    # Section IV.B
-    n = 0
-    row['Sum1_property'] = ''
-    row['Sum2_leasing'] = ''
-    for i in transport_tables[1].findAll('td'):
-        n += 1
-        if n % 3 == 1:
-            transport_name = i.decode_contents()
-        elif n % 3 == 2:
-            transport_type = complete_content(i.decode_contents())
-        else:
-            transport_year = complete_content(i.decode_contents())
-            row['point_title'] = transport_name
-            row['declarer/family'] = "сім'я"
-            content = [transport_type[i] + ', ' + transport_year[i] +
-                       'р.в.' for i in range(0, len(transport_type))]
-            for item in content:
-                row['content'] = item.strip()
-                if row['content']:
-                    write_decl_row(row, writer)
-
-    # ------------- Parse section V -------------
-    depostock_tables = sections[4].findAll('table')
-
-    # Section V.A
-    row = dict()
-    row['person'] = person_name
-    row['declaration_year'] = year
-    row['decl_section'] = section_headers[4].decode_contents()
-    n = 0
-    for i in depostock_tables[0].findAll('td'):
-        n += 1
-        if n % 3 == 1:
-            depostock_type = i.decode_contents()
-        elif n % 3 == 2:
-            row['declarer/family'] = "декларант"
-            row['point_title'] = depostock_type
-            if 'та' in i.decode_contents():
-                row['content'] = ';'.join(
-                    re.compile('\d+').findall(i.decode_contents()))
-                row['additional_information'] = row['content']
-                write_decl_row(row, writer)
-            else:
-                depostock_sum = complete_content(i.decode_contents())
-                for item in depostock_sum:
-                    if item != '':
-                        row['content'] = item
-                        if not row['content'].isdigit():
-                            row['additional_information'] = row['content']
-                        write_decl_row(row, writer)
+            row.point_title = income_type
+            for declarer_family, value in zip(VALUES_ORDER, (personal_value, family_value)):
+                row.declarer_family = declarer_family
+                row.content = value
+                row.additional_information = '' if value.isdigit() else value
+                if value:
+                    rows.append(row.values())
+        elif len(tds) == 1 and tds[0].attrs.get('colspan') == "3":
+            rows[-1][ADDITIONAL_INFORMATION] = tds[0].get_text()
+    yield from (values for values in rows if values[POINT_TITLE] != '')
+
+
+def foreign_income_rows(row, cells, notes):
+    '''
+    Sections II.B and II.V: country, sum in currency with the currency name, sum in hryvnias.
+    notes - not numeric sum goes to additional_information
+    '''
+    if len(cells) < 3:
+        return
+    income_country, currency_income, content = cells
+    row.point_title = "Одержані (нараховані) з джерел за межами України"
+    row.content = content
+    if notes and not content.isdigit():
+        row.additional_information = content
+    row.Name_of_country = income_country
+    currency_parts = currency_income.split(' ')
+    row.Name_of_currency = currency_parts[1] if len(currency_parts) > 1 else 'назву валюти не зазначено'
+    row.Sum3_income_in_currency = currency_parts[0]
+    if any([row.content, row.Sum3_income_in_currency]):
+        yield from row.emit()
+
+
+def real_estate_rows(row, cells, option):
+    '''
+    Section III.A: type, squares, purchase sums, leasing sums, one item per line
+    '''
+    if len(cells) < 4:
+        return
+    row.point_title = cells[0]
+    square, sum_property, sum2_leasing = [complete_content(cell) for cell in cells[1:]]
+    for e in range(len(square)):
+        row.content = square[e]
+        if not row.content.isdigit():
+            row.additional_information = row.content
+        row.Sum1_property = sum_property[e]
+        row.Sum2_leasing = sum2_leasing[e]
+        if any([row.content, row.Sum1_property, row.Sum2_leasing]):
+            yield from row.emit()
+
+
+def family_real_estate_rows(row, cells, option):
+    '''
+    Section III.B: type, squares
+    '''
+    if len(cells) < 2:
+        return
+    row.point_title = cells[0]
+    for item in complete_content(cells[1]):
+        row.content = item
+        if not row.content.isdigit():
+            row.additional_information = row.content
+        if row.content:
+            yield from row.emit()
+
+
+def transport_rows(row, cells, cells_count):
+    '''
+    Sections IV.A and IV.B: name, types, years of manufacture and, for the declarant, purchase and leasing sums.
+    cells_count - cells in a record of the table, 5 with the sums
+    '''
+    if len(cells) < cells_count:
+        return
+    row.point_title = cells[0]
+    transport_type, transport_year = complete_content(cells[1]), complete_content(cells[2])
+    content = [transport_type[i] + ', ' + transport_year[i] + 'р.в.' for i in range(0, len(transport_type))]
+    if cells_count == 5:
+        sum_property, sum2_leasing = complete_content(cells[3]), complete_content(cells[4])
+    for e in range(len(content)):
+        row.content = content[e].strip()
+        if cells_count == 5:
+            row.Sum1_property = sum_property[e]
+            row.Sum2_leasing = sum2_leasing[e]
+        if any([row.content, row.Sum1_property, row.Sum2_leasing]):
+            yield from row.emit()
+
+
+def deposit_rows(row, cells, foreign_suffix):
+    '''
+    Sections V.A and V.B: type, sums in Ukraine, sums abroad (point_title gets foreign_suffix)
+    '''
+    if len(cells) < 2:
+        return
+    depostock_type = cells[0]
+    row.point_title = depostock_type
+    yield from deposit_items(row, cells[1])
+    if len(cells) > 2:
+        row.point_title = depostock_type + foreign_suffix
+        yield from deposit_items(row, cells[2])
+
+
+def deposit_items(row, cell):
+    if 'та' in cell:
+        row.content = ';'.join(DIGITS_RE.findall(cell))
+        row.additional_information = row.content
+        yield from row.emit()
+    else:
+        for item in complete_content(cell):
+            if item != '':
+                row.content = item
+                if not row.content.isdigit():
+                    row.additional_information = row.content
+                yield from row.emit()
+
+
+def liability_rows(row, cells, option):
+    '''
+    Section VI.A: type, sums, sums abroad, one row per sum
+    '''
+    if len(cells) < 3:
+        return
+    finliability_type = cells[0]
+    finliability_sum, finliability_sum_foreign = complete_content(cells[1]), complete_content(cells[2])
+    if any(finliability_sum):
+        row.point_title = finliability_type
+        for item in finliability_sum:
+            yield from liability_item(row, item, ' та')
+    if any(finliability_sum_foreign):
+        row.point_title = finliability_type + ' закордоном'
+        # the rows abroad have always repeated the sums in Ukraine
+        for item in finliability_sum:
+            yield from liability_item(row, item, 'та')
+
+
+def liability_item(row, item, separator):
+    if separator in item:
+        row.content = ';'.join(NUMBERS_RE.findall(item))
+        row.additional_information = row.content
+    else:
+        row.content = item
+        if not row.content.isdigit():
+            row.additional_information = row.content
+    yield from row.emit()
+
+
+def family_liability_rows(row, cells, option):
+    '''
+    Section VI.B: type, sums, sums abroad, all sums of a kind in one row
+    '''
+    if len(cells) < 3:
+        return
+    finliability_type = cells[0]
+    for suffix, sums in (('', complete_content(cells[1])), (' закордоном', complete_content(cells[2]))):
+        if sums[0]:
+            row.point_title = finliability_type + suffix
+            row.content = ';'.join(sums)
+            if not row.content.isdigit():
+                row.additional_information = row.content
+            yield from row.emit()
+
+
+# Tables of the declaration: (section, table in the section, cells in a record, declarer/family, rule, rule option).
+# Records are the table's <td> taken by `cells`; the table with None cells is given to the rule whole
+DECL_SCHEMA = [
+    (0, 0, 2, '', family_rows, None),
+    (1, 0, None, '', income_rows, None),
+    (1, 1, 3, 'декларант', foreign_income_rows, True),
+    (1, 2, 3, "сім'я", foreign_income_rows, False),
+    (2, 0, 4, 'декларант', real_estate_rows, None),
+    (2, 1, 2, "сім'я", family_real_estate_rows, None),
+    (3, 0, 5, 'декларант', transport_rows, 5),
+    (3, 1, 3, "сім'я", transport_rows, 3),
+    (4, 0, 3, 'декларант', deposit_rows, 'закордоном'),
+    (4, 1, 3, "сім'я", deposit_rows, ''),
+    (5, 0, 3, 'декларант', liability_rows, None),
+    (5, 1, 3, "сім'я", family_liability_rows, None),
+]
+SECTION_NAMES = ['I', 'II', 'III', 'IV', 'V', 'VI']
+
+
+def table_rows(table, row, cells_count, rule, option, cells=None):
+    '''
+    Yields rows of a declaration table by its DECL_SCHEMA rule. cells - contents of the table's <td>
+    if they are already serialized
+    '''
+    if cells_count is None:
+        yield from rule(row, table, option)
+    else:
+        if cells is None:
+            cells = [td.decode_contents() for td in table.findAll('td')]
+        for start in range(0, len(cells), cells_count):
+            yield from rule(row, cells[start:start + cells_count], option)
+
+
+def iter_decl_rows(page, person_name, year, parser=None, timings=None):
+    '''
+    Parses declaration page lazily by DECL_SCHEMA: yields its rows as lists in FIELDS order, section by section.
+    Every cell is serialized once. Time of every section, including the time its rows were consumed,
+    is put to timings dictionary if it is given
+    '''
+    if (parser or PARSER) == 'stream' and import_lxml() is not None:
+        yield from iter_streamed_decl_rows(page, person_name, year, timings)
+        return
+    lap = SectionTimer(timings)
+    soup = make_soup(page, parser)
+    declaration_div = soup.find('div', id="declaration")
+    section_headers = declaration_div.findAll('h3', recursive=False)
+    sections = declaration_div.findAll('div', recursive=False)
+
+    for n, (section, table, cells_count, declarer_family, rule, option) in enumerate(DECL_SCHEMA):
+        if table == 0:
+            tables = sections[section].findAll('table')
+            decl_section = section_headers[section].decode_contents()
+        row = DeclRow(person_name, year, decl_section)
+        row.declarer_family = declarer_family
+        yield from table_rows(tables[table], row, cells_count, rule, option)
+        if n + 1 == len(DECL_SCHEMA) or DECL_SCHEMA[n + 1][0] != section:
+            lap(SECTION_NAMES[section])
+
+
+def iter_streamed_decl_rows(page, person_name, year, timings=None):
+    '''
+    iter_decl_rows() for the 'stream' parser: the page is fed to lxml pull parser by PARSE_CHUNK_SIZE,
+    rows of a table are yielded as soon as the table is closed and the parsed elements are cleared.
+    A <td> of a table read by records is serialized and cleared when it is closed, so the tree holds
+    only the cell being parsed however large the page is
+    '''
+    lxml = import_lxml()
+    lap = SectionTimer(timings)
+    schema = dict(((entry[0], entry[1]), entry[2:]) for entry in DECL_SCHEMA)
+    html_parser = lxml.etree.HTMLPullParser(events=('start', 'end'), encoding='utf-8')
+    text = decode_page(page)
+    declaration_div = section_div = None
+    section_headers = []
+    # tables being parsed: element, DECL_SCHEMA entry and contents of its <td> read so far
+    open_tables = []
+    section = tables = -1
+    for start in range(0, len(text) + 1, PARSE_CHUNK_SIZE):
+        if start < len(text):
+            html_parser.feed(text[start:start + PARSE_CHUNK_SIZE].encode('utf-8'))
         else:
-            row['point_title'] = depostock_type + 'закордоном'
-            if 'та' in i.decode_contents():
-                row['content'] = ';'.join(
-                    re.compile('\d+').findall(i.decode_contents()))
-                row['additional_information'] = row['content']
-                write_decl_row(row, writer)
-            else:
-                depostock_sum_foreign = complete_content(i.decode_contents())
-                for item in depostock_sum_foreign:
-                    if item != '':
-                        row['content'] = item
-                        if not row['content'].isdigit():
-                            row['additional_information'] = row['content']
-                        write_decl_row(row, writer)
-
-    # Section V.B
-    row = dict()
-    row['person'] = person_name
-    row['declaration_year'] = year
-    row['decl_section'] = section_headers[4].decode_contents()
-    n = 0
-    for i in depostock_tables[1].findAll('td'):
-        n += 1
-        if n % 3 == 1:
-            depostock_type = i.decode_contents()
-        elif n % 3 == 2:
-            row['declarer/family'] = "сім'я"
-            row['point_title'] = depostock_type
-            if 'та' in i.decode_contents():
-                row['content'] = ';'.join(
-                    re.compile('\d+').findall(i.decode_contents()))
-                row['additional_information'] = row['content']
-                write_decl_row(row, writer)
+            html_parser.close()
+        for event, element in html_parser.read_events():
+            if declaration_div is None:
+                if event == 'start' and element.tag == 'div' and element.get('id') == 'declaration':
+                    declaration_div = element
+                elif event == 'end':
+                    element.clear()
+                continue
+            parent = element.getparent()
+            if event == 'start':
+                if parent is declaration_div and element.tag == 'div':
+                    section_div, section, tables = element, section + 1, 0
+                elif element.tag == 'table' and section_div is not None:
+                    # tables are numbered in document order, the way findAll() finds them
+                    entry = schema.get((section, tables))
+                    cells = [] if entry is not None and entry[0] is not None else None
+                    open_tables.append((element, entry, cells))
+                    tables += 1
+                continue
+            if parent is declaration_div and element.tag == 'h3':
+                section_headers.append(LxmlNode(element).decode_contents())
+            elif element is section_div:
+                section_div = None
+                if section < len(SECTION_NAMES):
+                    lap(SECTION_NAMES[section])
+            elif open_tables and open_tables[-1][0] is element:
+                table, entry, cells = open_tables.pop()
+                if entry is not None:
+                    cells_count, declarer_family, rule, option = entry
+                    row = DeclRow(person_name, year, section_headers[section])
+                    row.declarer_family = declarer_family
+                    yield from table_rows(LxmlNode(table), row, cells_count, rule, option, cells)
+            elif open_tables and open_tables[-1][2] is not None and element.tag in ('td', 'tr'):
+                if element.tag == 'td':
+                    open_tables[-1][2].append(LxmlNode(element).decode_contents())
             else:
-                depostock_sum = complete_content(i.decode_contents())
-                for item in depostock_sum:
-                    if item != '':
-                        row['content'] = item
-                        if not row['content'].isdigit():
-                            row['additional_information'] = row['content']
-                        write_decl_row(row, writer)
-        else:
-            row['point_title'] = depostock_type
-            if 'та' in i.decode_contents():
-                row['content'] = ';'.join(
-                    re.compile('\d+').findall(i.decode_contents()))
-                row['additional_information'] = row['content']
-                write_decl_row(row, writer)
+                continue
+            element.clear()
+            while element.getprevious() is not None:
+                del parent[0]
+    if declaration_div is None:
+        raise ValueError('No div#declaration in the page')
+
+
+def get_declarations(page):
+    '''
+    Returns [[link_on_declaration1, year1], [link_on_declaration2, year2]...] of deputy's preview page
+    '''
+    soup = make_soup(page)
+    return [[i['href'], get_dec_year(i.string)] for i in soup.findAll('a', href=re.compile("^/declview+"))]
+
+
+def crawl_person(person_id, person_name, known=(), downloads=None, index=None):
+    '''
+    Fetches deputy's preview page and all his declarations except the known ones.
+    Links of an unchanged preview page are taken from the PreviewIndex if it is given.
+    PDF declarations are given to the downloads pool, their status is a Future until the download ends.
+    Returns dictionary with the results, so they can be written in order
+    '''
+    started = time.time()
+    result = {'person_id': person_id, 'person_name': person_name, 'no_page': [], 'pages': [], 'declarations': []}
+    print(person_name)
+    page = get_page(DECLARATION_LIST_URL_PATTERN % person_id)
+    # Check is a deputy's page callable
+    if page is not None:
+        declarations = index.declarations(person_id, page) if index is not None else get_declarations(page)
+        for declaration in declarations:
+            if declaration[0] in known:
+                continue
+            if 'GetFile' in declaration[0]:
+                file_name = get_pdf_file_name(person_id, person_name, declaration[0], declaration[1])
+                if file_name is None:
+                    result['declarations'].append(declaration + ['no_dec'])
+                else:
+                    result['declarations'].append(declaration + [submit_download(
+                        downloads, DECLARATION_URL_PATTERN % declaration[0], FOLDER + file_name)])
+                continue
+            decl_page = get_page(DECLARATION_URL_PATTERN % declaration[0])
+            if decl_page is not None:
+                result['declarations'].append(declaration + ['data'])
+                result['pages'].append((decl_page, declaration[0], declaration[1]))
             else:
-                depostock_sum_foreign = complete_content(i.decode_contents())
-                for item in depostock_sum_foreign:
-                    if item != '':
-                        row['content'] = item
-                        if not row['content'].isdigit():
-                            row['additional_information'] = row['content']
-                        write_decl_row(row, writer)
-
-    # ------------- Parse section VI -------------
-
-    finliability_tables = sections[5].findAll('table')
-
-    # Section VI.A
-    row = dict()
-    row['person'] = person_name
-    row['declaration_year'] = year
-    row['decl_section'] = section_headers[5].decode_contents()
-    n = 0
-    for i in finliability_tables[0].findAll('td'):
-        n += 1
-        if n % 3 == 1:
-            finliability_type = i.decode_contents()
-        elif n % 3 == 2:
-            finliability_sum = complete_content(i.decode_contents())
+                result['declarations'].append(declaration + ['no_dec'])
+    else:
+        result['no_page'].append(person_name + '\n')
+    result['seconds'] = time.time() - started
+    return result
+
+
+def submit_download(pool, url, file_name):
+    '''
+    Starts download of PDF declaration. Returns Future with True if the file is downloaded
+    '''
+    if pool is None:
+        future = Future()
+        future.set_result(download_file(url, file_name))
+        return future
+    return pool.submit(download_file, url, file_name)
+
+
+def parse_decl_rows(page, person_name, year, parser=None):
+    '''
+    Parses declaration page and returns its rows and section timings. Runs in the parse worker processes
+    '''
+    timings = {}
+    rows = list(iter_decl_rows(page, person_name, year, parser, timings))
+    return rows, timings
+
+
+def parse_archived_rows(page, person_name, year, parser=None):
+    '''
+    parse_decl_rows() for a compressed page of PageArchive
+    '''
+    return parse_decl_rows(zlib.decompress(page), person_name, year, parser)
+
+
+def submit_parse(pool, result):
+    '''
+    Sends declaration pages fetched by crawl_person() to the parse workers.
+    Futures replace the pages, so the page bytes are not kept until the deputy is written
+    '''
+    futures = []
+    for page, href, year in result['pages']:
+        if pool is None:
+            future = Future()
+            future.set_result(parse_decl_rows(page, result['person_name'], year, PARSER))
         else:
-            row['declarer/family'] = "декларант"
-            finliability_sum_foreign = complete_content(i.decode_contents())
-            if any(finliability_sum):
-                row['point_title'] = finliability_type
-                for item in finliability_sum:
-                    if ' та' in item:
-                        row['content'] = ';'.join(
-                            re.compile('\d+.*\d+').findall(item))
-                        row['additional_information'] = row['content']
-                    else:
-                        row['content'] = item
-                        if not row['content'].isdigit():
-                            row['additional_information'] = row['content']
-                    write_decl_row(row, writer)
-            if any(finliability_sum_foreign):
-                row['point_title'] = finliability_type + ' закордоном'
-                for item in finliability_sum:
-                    if 'та' in item:
-                        row['content'] = ';'.join(
-                            re.compile('\d+.*\d+').findall(item))
-                        row['additional_information'] = row['content']
-                    else:
-                        row['content'] = item
-                        if not row['content'].isdigit():
-                            row['additional_information'] = row['content']
-                    write_decl_row(row, writer)
-
-    # Section VI.B
-    row = dict()
-    row['additional_information'] = ''
-    row['person'] = person_name
-    row['declaration_year'] = year
-    row['decl_section'] = section_headers[5].decode_contents()
-    n = 0
-    for i in finliability_tables[1].findAll('td'):
-        n += 1
-        if n % 3 == 1:
-            finliability_type = i.decode_contents()
-        elif n % 3 == 2:
-            finliability_sum = complete_content(i.decode_contents())
+            future = pool.submit(parse_decl_rows, page, result['person_name'], year, PARSER)
+        futures.append((href, future))
+    result['pages'] = futures
+
+
+def result_ready(result):
+    '''
+    Tells if all pages of crawl_person() result are parsed and all its PDF declarations are downloaded
+    '''
+    return all(future.done() for href, future in result['pages']) and \
+        all(declaration[2].done() for declaration in result['declarations'] if isinstance(declaration[2], Future))
+
+
+def write_person_result(sink, result):
+    '''
+    Writes lines for result of crawl_person() and parsed rows to the output files
+    '''
+    person_name = result['person_name']
+    lines = {'list': [], 'no_dec': [], 'no_page': result['no_page']}
+    done = []
+    for declaration in result['declarations']:
+        if isinstance(declaration[2], Future):
+            declaration[2] = 'pdf' if declaration[2].result() else 'no_dec'
+        href, year, status = declaration
+        if status == 'no_dec':
+            lines['no_dec'].append(person_name + "," + year + '\n')
         else:
-            row['declarer/family'] = "сім'я"
-            finliability_sum_foreign = complete_content(i.decode_contents())
-            if finliability_sum[0]:
-                row['point_title'] = finliability_type
-                row['content'] = ';'.join(finliability_sum)
-                if not row['content'].isdigit():
-                    row['additional_information'] = row['content']
-                write_decl_row(row, writer)
-            if finliability_sum_foreign[0]:
-                row['point_title'] = finliability_type + ' закордоном'
-                row['content'] = ';'.join(finliability_sum_foreign)
-                if not row['content'].isdigit():
-                    row['additional_information'] = row['content']
-                write_decl_row(row, writer)
-
-    filehandler.close()
-
-
-def main(url):
-    '''
-    The main procedure. Downloads declarations, complete CSV_FILE, NO_DEC_FILE, NO_PAGE_FILE
-    '''
-    people_list = get_people(url)
-    for person_id in people_list:
-        print(people_list[person_id][1])
-        time.sleep(SLEEP_TIME)
-        page = get_page(DECLARATION_LIST_URL_PATTERN % person_id)
-        #print(DECLARATION_LIST_URL_PATTERN % person_id, 'is in process')
-        # Check is a deputy's page callable
-        if page is not None:
-            #print('get page', DECLARATION_LIST_URL_PATTERN % person_id)
-            soup = BeautifulSoup(page)
-            # declarations = [[link_on_declaration1,
-            # year1],[link_on_declaration2, year2]...]
-            declarations = [[i['href'], get_dec_year(i.string)] for i in soup.findAll(
-                'a', href=re.compile("^/declview+"))]
-            for declaration in declarations:
-                decl_page = get_page(DECLARATION_URL_PATTERN % declaration[0])
-                if decl_page is not None:
-                    #print('get page', DECLARATION_URL_PATTERN % declaration[0])
-                    if 'GetFile' in declaration[0]:
-                        # download declaration
-                        '''
-                        try:
-                            urlretrieve(DECLARATION_URL_PATTERN % declaration[0], FOLDER
-                                        + get_dec_file_name(unidecode(people_list[person_id][1]), declaration[1]))
-                        # except socket.error as error:
-                        except:
-                            b = codecs.open(
-                                NO_DEC_FILE, 'a')
-                            b.write(
-                                people_list[person_id][1] + "," + declaration[1] + '\n')
-                            b.close()
-
-                        # write deputy in csv_file
-                        a = codecs.open(CSV_FILE, 'a')
-                        a.write(
-                            people_list[person_id][1] + "," + declaration[1] + "," + "pdf" + '\n')
-                        a.close()
-                        '''
-                    else:
-                        a = codecs.open(CSV_FILE, 'a')
-                        a.write(
-                            people_list[person_id][1] + "," + declaration[1] + "," + "data" + '\n')
-                        a.close()
-                        parse_decl(
-                            decl_page, people_list[person_id][1], declaration[1])
-                else:
-                    b = codecs.open(NO_DEC_FILE, 'a')
-                    b.write(
-                        people_list[person_id][1] + "," + declaration[1] + '\n')
-                    b.close()
+            lines['list'].append(person_name + "," + year + "," + status + '\n')
+            done.append(href)
+    for key in ('list', 'no_dec', 'no_page'):
+        if lines[key]:
+            sink.write_lines(key, lines[key])
+    rows_by_href = {}
+    seconds = result['seconds']
+    for href, future in result['pages']:
+        rows_by_href[href], timings = future.result()
+        sink.write_rows(rows_by_href[href])
+        METRICS.parse(timings)
+        seconds += sum(timings.values())
+    METRICS.person(person_name, seconds)
+    if sink.database is not None:
+        sink.database.write_declarations(result['person_id'], result['declarations'], rows_by_href)
+    sink.add_done(result['person_id'], done)
+
+
+def start_run(resume, incremental):
+    '''
+    Opens output files and starts the journal for the run.
+    Returns the output sink, the set of deputies finished by the interrupted run
+    and {person_id: set of known declaration links}
+    '''
+    journal = read_journal()
+    starts = [n for n, record in enumerate(journal) if 'start' in record]
+    finished = set()
+    database = None
+    if SQLITE_FILE:
+        database = SQLiteSink(SQLITE_FILE, fresh=not (resume and starts) and not incremental)
+    if resume and starts:
+        start = starts[-1]
+        incremental = journal[start]['incremental']
+        finished = set(record['person_id'] for record in journal[start + 1:])
+        sink = OutputSink(sizes=journal[-1]['sizes'], database=database,
+                          archive=open_archive(not incremental, resume=True))
+        previous = journal[:start]
+    else:
+        previous = journal
+        if incremental and os.path.exists(TSV_FILE):
+            # declarations and list are appended, failures are checked again from scratch
+            sink = OutputSink(keep=('tsv', 'list'), database=database, archive=open_archive(False))
+            write_journal([{'start': time.time(), 'incremental': True, 'sizes': sink.sizes()}])
         else:
-            a = codecs.open(NO_PAGE_FILE, 'a')
-            a.write(people_list[person_id][1] + '\n')
-            a.close()
+            incremental = False
+            sink = OutputSink(database=database, archive=open_archive(True))
+            write_journal([{'start': time.time(), 'incremental': False, 'sizes': sink.sizes()}], 'w')
+
+    known = {}
+    if incremental:
+        for record in previous:
+            if 'person_id' in record:
+                known.setdefault(record['person_id'], set()).update(record['declarations'])
+    return sink, finished, known
+
+
+def main(url, resume=False, incremental=False):
+    '''
+    The main procedure. Downloads declarations, complete CSV_FILE, NO_DEC_FILE, NO_PAGE_FILE.
+    url is the deputies list or a list of them for several convocations; DEPUTIES_FILE tells
+    which convocations every deputy belongs to.
+    Deputies are fetched by WORKERS threads, declaration pages are parsed by PARSE_WORKERS processes,
+    PDF declarations are saved to FOLDER by PDF_WORKERS threads,
+    results are written in the order of people_list. Declaration links of the preview pages
+    that have not changed since the previous run are taken from INDEX_FILE.
+    Every CHECKPOINT_EVERY deputies the files are flushed and a checkpoint is written to JOURNAL_FILE,
+    so an interrupted run can be resumed. Output files get their final names only when the run is complete.
+    Request and parse timings of the run are written to METRICS_FILE and REQUESTS_LOG_FILE
+    '''
+    sink, finished, known = start_run(resume, incremental)
+    people_list = get_all_people([url] if isinstance(url, str) else url)
+    write_deputies_file(people_list)
+    if sink.database is not None:
+        sink.database.write_deputies(people_list)
+    people_ids = [person_id for person_id in people_list if person_id not in finished]
+    pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS) if PARSE_WORKERS else None
+    downloads = ThreadPoolExecutor(max_workers=PDF_WORKERS) if PDF_WORKERS else None
+    index = PreviewIndex(INDEX_FILE) if INDEX_FILE else None
+    try:
+        with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+            results = executor.map(lambda person_id: crawl_person(person_id, people_list[person_id][1],
+                                                                  known.get(person_id, ()), downloads, index),
+                                   people_ids)
+            # deputies waiting for their pages to be parsed and PDFs downloaded, written strictly in order
+            pending = deque()
+            for result in results:
+                if sink.archive is not None:
+                    for page, href, year in result['pages']:
+                        sink.archive.put(result['person_id'], result['person_name'], href, year, page)
+                submit_parse(pool, result)
+                pending.append(result)
+                while pending and result_ready(pending[0]):
+                    write_person_result(sink, pending.popleft())
+            while pending:
+                write_person_result(sink, pending.popleft())
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if downloads is not None:
+            downloads.shutdown()
+    sink.close()
+    if index is not None:
+        index.save()
+    SESSION.close()
+    CACHE.save()
+    METRICS.report(METRICS_FILE, REQUESTS_LOG_FILE)
+
+
+def reparse(archive_file=None):
+    '''
+    Rebuilds TSV_FILE (and SQLITE_FILE if it is set) from the pages in ARCHIVE_FILE without network access.
+    Pages are parsed by PARSE_WORKERS processes, rows are written in the archive order
+    '''
+    started = time.time()
+    archive = PageArchive(archive_file or ARCHIVE_FILE)
+    database = SQLiteSink(SQLITE_FILE) if SQLITE_FILE else None
+    pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS) if PARSE_WORKERS else None
+    entries = list(archive.pages())
+    # pages stay compressed on the way to the workers
+    arguments = ([entry[4] for entry in entries], [entry[1] for entry in entries], [entry[3] for entry in entries],
+                 [PARSER] * len(entries))
+    if pool is not None:
+        parsed = pool.map(parse_archived_rows, *arguments, chunksize=REPARSE_CHUNK)
+    else:
+        parsed = map(parse_archived_rows, *arguments)
+    declarations = rows_count = 0
+    try:
+        with open(TSV_FILE + '.part', 'w', encoding='utf-8', newline='') as f:
+            f.write(tsv_header())
+            writer = csv.writer(f, delimiter='\t')
+            for (person_id, person_name, href, year, page), (rows, timings) in zip(entries, parsed):
+                writer.writerows(rows)
+                if database is not None:
+                    database.write_declarations(person_id, [[href, year, 'data']], {href: rows})
+                declarations += 1
+                rows_count += len(rows)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        archive.close()
+        if database is not None:
+            database.close()
+    if CHANGES_FILE:
+        print('%d blocks changed' % write_changes(TSV_FILE, TSV_FILE + '.part'))
+    os.replace(TSV_FILE + '.part', TSV_FILE)
+    print('%d declarations, %d rows reparsed in %.1f s' % (declarations, rows_count, time.time() - started))
+
+
+def queue_result(result, archived, index=None):
+    '''
+    Turns the result of crawl_person() with its parsed pages into JSON for WorkQueue.
+    archived - [(page, href, year)] of the declaration pages, sent zlib-compressed for the coordinator's archive;
+    the deputy's entry of the PreviewIndex is sent for the coordinator's index
+    '''
+    declarations = []
+    for href, year, status in result['declarations']:
+        if isinstance(status, Future):
+            status = 'pdf' if status.result() else 'no_dec'
+        declarations.append([href, year, status])
+    return {'person_id': result['person_id'], 'person_name': result['person_name'], 'no_page': result['no_page'],
+            'declarations': declarations, 'seconds': result['seconds'],
+            'pages': [[href] + list(future.result()) for href, future in result['pages']],
+            'archived': [[href, year, base64.b64encode(zlib.compress(page)).decode('ascii')]
+                         for page, href, year in archived],
+            'index': index.get(result['person_id']) if index is not None and not result['no_page'] else None}
+
+
+def unqueue_result(result):
+    '''
+    Turns the result from WorkQueue back to crawl_person() result with parsed pages for write_person_result()
+    '''
+    pages = []
+    for href, rows, timings in result['pages']:
+        future = Future()
+        future.set_result((rows, timings))
+        pages.append((href, future))
+    result['pages'] = pages
+    return result
+
+
+def renew_leases(queue_file, worker, stopped):
+    '''
+    Renews the leases of worker every third of LEASE_SECONDS until stopped is set,
+    so slow deputies are not leased again while the worker is still crawling them
+    '''
+    # a connection of its own, SQLite connections are not shared between threads
+    queue = WorkQueue(queue_file)
+    try:
+        while not stopped.wait(LEASE_SECONDS / 3.0):
+            queue.renew(worker)
+    finally:
+        queue.close()
+
+
+def worker_settings():
+    '''
+    Settings of this process for the local workers: module settings of plain types, the cache folder
+    and the request rate. A worker started by spawn imports the module with the defaults otherwise
+    '''
+    settings = {}
+    for name, value in globals().items():
+        if name.isupper():
+            try:
+                json.dumps(value)
+            except (TypeError, ValueError):
+                continue
+            settings[name] = value
+    settings.update(CACHE_FOLDER=CACHE.folder, CACHE_MAX_SIZE=CACHE.max_size, REQUESTS_PER_SECOND=SCHEDULER.rate)
+    return settings
+
+
+def apply_settings(settings):
+    global CACHE, SCHEDULER
+    globals().update(settings)
+    CACHE = ResponseCache(CACHE_FOLDER, CACHE_MAX_SIZE)
+    SCHEDULER = RequestScheduler(REQUESTS_PER_SECOND)
+
+
+def work(queue_file=None, worker=None, settings=None):
+    '''
+    Worker of the distributed crawl. Leases WORKERS deputies at a time from the queue, crawls them,
+    parses their declarations in PARSE_WORKERS processes and completes them with the rows,
+    until no deputy is left in the queue. Its leases are renewed while it runs.
+    PDF declarations are saved to FOLDER of the worker.
+    INDEX_FILE is only read, the coordinator saves the index entries sent with the results.
+    settings - worker_settings() of the coordinator for the workers it starts
+    '''
+    if settings is not None:
+        apply_settings(settings)
+    worker = worker or '%s:%d' % (socket.gethostname(), os.getpid())
+    queue_file = queue_file or QUEUE_FILE
+    queue = WorkQueue(queue_file)
+    index = PreviewIndex(INDEX_FILE) if INDEX_FILE else None
+    pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS) if PARSE_WORKERS else None
+    completed = 0
+    stopped = threading.Event()
+    heartbeat = threading.Thread(target=renew_leases, args=(queue_file, worker, stopped))
+    heartbeat.daemon = True
+    heartbeat.start()
+    try:
+        with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+            while True:
+                items = queue.lease(worker, WORKERS)
+                if not items:
+                    counts = queue.counts()
+                    if not counts.get('pending') and not counts.get('leased'):
+                        break
+                    # the rest is leased by other workers, their leases may expire
+                    time.sleep(QUEUE_POLL)
+                    continue
+                results = executor.map(lambda item: crawl_person(item[0], item[1], index=index), items)
+                for result in results:
+                    archived = result['pages']
+                    submit_parse(pool, result)
+                    completed += queue.complete(result['person_id'], worker, queue_result(result, archived, index))
+    finally:
+        stopped.set()
+        heartbeat.join()
+        if pool is not None:
+            pool.shutdown()
+        queue.close()
+    SESSION.close()
+    CACHE.save()
+    print('%s: %d deputies completed' % (worker, completed))
+
+
+def coordinate(url, queue_file=None, resume=False, local_workers=0):
+    '''
+    Coordinator of the distributed crawl. Puts the deputies to the queue and writes the results of the workers
+    to the output files in the queue order, like main() does. Workers are started with the work command
+    on any host that sees queue_file, local_workers of them are started here; the run fails
+    when all of them have exited before the queue is done.
+    resume keeps the queue of the interrupted run with the deputies done so far
+    '''
+    queue_file = queue_file or QUEUE_FILE
+    queue = WorkQueue(queue_file)
+    sink = start_run(False, False)[0]
+    people_list = get_all_people([url] if isinstance(url, str) else url)
+    write_deputies_file(people_list)
+    if sink.database is not None:
+        sink.database.write_deputies(people_list)
+    if not (resume and queue.counts()):
+        queue.seed(people_list)
+    index = PreviewIndex(INDEX_FILE) if INDEX_FILE else None
+    # worker processes must not share the keep-alive connections of this one
+    SESSION.close()
+    # fork keeps the state of this process where it is available, the settings are passed for spawn anyway
+    context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+    processes = [context.Process(target=work, args=(queue_file, None, worker_settings()))
+                 for n in range(local_workers)]
+    for process in processes:
+        process.start()
+    try:
+        for person_id, person_name in queue.items():
+            state, result = queue.result(person_id)
+            while state not in ('done', 'failed'):
+                # checked before the state is read, so a worker which has just completed the deputy is not a failure
+                workers_alive = not processes or any(process.is_alive() for process in processes)
+                time.sleep(QUEUE_POLL)
+                queue.expire()
+                state, result = queue.result(person_id)
+                if not workers_alive and state not in ('done', 'failed'):
+                    raise RuntimeError('Workers exited before the queue was done, exit codes: %s' %
+                                       ', '.join(str(process.exitcode) for process in processes))
+            if state == 'failed':
+                sink.write_lines('no_page', [person_name + '\n'])
+                sink.add_done(person_id, [])
+                continue
+            if sink.archive is not None:
+                for href, year, page in result['archived']:
+                    sink.archive.put(person_id, person_name, href, year, zlib.decompress(base64.b64decode(page)))
+            if index is not None and result['index'] is not None:
+                index.update(person_id, result['index'])
+            write_person_result(sink, unqueue_result(result))
+    finally:
+        for process in processes:
+            process.join()
+        queue.close()
+    sink.close()
+    if index is not None:
+        index.save()
+    CACHE.save()
+    METRICS.report(METRICS_FILE, REQUESTS_LOG_FILE)
+
+
+def count_lines(file_name):
+    if not os.path.exists(file_name):
+        return 0
+    with open(file_name, 'rb') as f:
+        return sum(1 for line in f)
+
+
+def print_stats():
+    '''
+    Prints what the output files hold and the summary of the last run from METRICS_FILE
+    '''
+    if os.path.exists(TSV_FILE):
+        person, year, section = [FIELDS.index(field) for field in ('person', 'declaration_year', 'decl_section')]
+        rows_by_section = {}
+        declarations = set()
+        for row in read_decl_rows():
+            if len(row) < len(FIELDS):
+                continue
+            rows_by_section[row[section]] = rows_by_section.get(row[section], 0) + 1
+            declarations.add((row[person], row[year]))
+        print('%s: %d rows, %d deputies, %d declarations' % (
+            TSV_FILE, sum(rows_by_section.values()), len(set(person for person, year in declarations)),
+            len(declarations)))
+        for decl_section in sorted(rows_by_section):
+            print('    %-60s %d' % (decl_section, rows_by_section[decl_section]))
+    if os.path.exists(CSV_FILE):
+        sources = {}
+        with open(CSV_FILE, encoding='utf-8') as f:
+            for line in f:
+                source = line.rstrip('\n').rpartition(',')[2]
+                sources[source] = sources.get(source, 0) + 1
+        print('%s: %s' % (CSV_FILE, ', '.join('%d %s' % (sources[source], source) for source in sorted(sources))))
+    if os.path.exists(DEPUTIES_FILE):
+        convocations = {}
+        with open(DEPUTIES_FILE, encoding='utf-8', newline='') as f:
+            for person_id, deputy_name, person_convocations in csv.reader(f):
+                for convocation in person_convocations.split(';'):
+                    convocations[convocation] = convocations.get(convocation, 0) + 1
+        print('%s: %s' % (DEPUTIES_FILE, ', '.join('%d in convocation %s' % (convocations[convocation], convocation)
+                                                     for convocation in sorted(convocations))))
+    print('%s: %d' % (NO_DEC_FILE, count_lines(NO_DEC_FILE)))
+    print('%s: %d' % (NO_PAGE_FILE, count_lines(NO_PAGE_FILE)))
+    if os.path.exists(METRICS_FILE):
+        with open(METRICS_FILE, encoding='utf-8') as f:
+            metrics = json.load(f)
+        print('last run %s: %s s, %d requests, %d bytes, %d declarations parsed' % (
+            metrics['started'], metrics['duration'], metrics['requests'], metrics['bytes'],
+            metrics['declarations_parsed']))
+
+
+def parse_args(argv=None):
+    '''
+    Reads the command line. Without a command the script crawls, so the old `script.py --resume` still works
+    '''
+    parser = argparse.ArgumentParser(description='Downloads and parses MPs declarations from Verkhovna Rada website')
+    commands = parser.add_subparsers(dest='command', metavar='command')
+
+    parser_options = argparse.ArgumentParser(add_help=False)
+    parser_options.add_argument('--parser', choices=PARSERS, default=PARSER,
+                                help='HTML parser for declaration pages (default: %(default)s)')
+    parser_options.add_argument('--parse-workers', type=int, default=PARSE_WORKERS,
+                                help='processes parsing declaration pages, 0 to parse in the main process '
+                                     '(default: %(default)s)')
+    parse_options = argparse.ArgumentParser(add_help=False, parents=[parser_options])
+    parse_options.add_argument('--sqlite', metavar='FILE', default=SQLITE_FILE,
+                               help='also write deputies, declarations and declaration items to SQLite database')
+    parse_options.add_argument('--convocations', metavar='SKL_ID', nargs='+', type=int,
+                               help='convocations to crawl, deputies of several ones are crawled once '
+                                    '(default: %s)' % ' '.join(str(convocation) for convocation in CONVOCATIONS))
+    parse_options.add_argument('--export', metavar='FILE',
+                               help='afterwards export declarations to Parquet file, '
+                                    'or Arrow file if FILE ends with .arrow')
+
+    crawl = commands.add_parser('crawl', parents=[parse_options],
+                                help='download and parse the declarations (default command)')
+    crawl.add_argument('--resume', action='store_true',
+                       help='continue the interrupted run, deputies already done are skipped')
+    crawl.add_argument('--incremental', action='store_true',
+                       help='fetch only declarations which appeared since the previous runs')
+
+    commands.add_parser('reparse', parents=[parse_options],
+                        help='rebuild declarations.tsv from the archived pages, without network access')
+
+    coordinate = commands.add_parser('coordinate', parents=[parse_options],
+                                     help='distributed crawl: queue the deputies for the workers '
+                                          'and write their results')
+    coordinate.add_argument('--queue', metavar='FILE', default=QUEUE_FILE,
+                            help='queue shared with the workers (default: %(default)s)')
+    coordinate.add_argument('--resume', action='store_true',
+                            help='keep the queue of the interrupted run, deputies already done are not crawled again')
+    coordinate.add_argument('--local-workers', type=int, default=0, metavar='N',
+                            help='also start N workers on this host (default: %(default)s)')
+
+    work = commands.add_parser('work', parents=[parser_options],
+                               help='distributed crawl: crawl the deputies of the coordinator\'s queue')
+    work.add_argument('--queue', metavar='FILE', default=QUEUE_FILE,
+                      help='queue of the coordinator (default: %(default)s)')
+
+    export = commands.add_parser('export', help='export declarations.tsv to Parquet or Arrow file')
+    export.add_argument('file', help='Parquet file, or Arrow file if it ends with .arrow')
+    export.add_argument('--tsv', metavar='FILE', default=TSV_FILE, help='rows to export (default: %(default)s)')
+
+    summary = commands.add_parser('summary', help='write totals of income, property, deposits and liabilities '
+                                                   'for every deputy and year')
+    summary.add_argument('file', nargs='?', default=SUMMARY_FILE,
+                         help='CSV file, or Parquet file if it ends with .parquet (default: %(default)s)')
+    summary.add_argument('--tsv', metavar='FILE', default=TSV_FILE, help='rows to summarize (default: %(default)s)')
+    summary.add_argument('--sqlite', metavar='FILE', default=SQLITE_FILE, help='also write summary table to the database')
+
+    commands.add_parser('stats', help='print what the output files hold and the summary of the last run')
+
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0].startswith('-') and argv[0] not in ('-h', '--help'):
+        argv.insert(0, 'crawl')
+    return parser.parse_args(argv)
+
+
+def run_command(args):
+    global PARSER, PARSE_WORKERS, SQLITE_FILE, CACHE_ONLY
+
+    if args.command == 'export':
+        export_rows(args.file, args.tsv)
+        return
+    if args.command == 'stats':
+        print_stats()
+        return
+    if args.command == 'summary':
+        SQLITE_FILE = args.sqlite
+        write_summary(args.file, args.tsv)
+        return
+    PARSER = args.parser
+    PARSE_WORKERS = args.parse_workers
+    if args.command == 'work':
+        create_folder()
+        work(args.queue)
+        return
+    SQLITE_FILE = args.sqlite
+    urls = [MAIN_URL_PATTERN % convocation for convocation in args.convocations or CONVOCATIONS]
+    create_folder()
+    if args.command == 'reparse' and ARCHIVE_FILE and os.path.exists(ARCHIVE_FILE):
+        reparse()
+    elif args.command == 'reparse':
+        # no archive yet: replay the crawl from the cache
+        CACHE_ONLY = True
+        main(urls)
+    elif args.command == 'coordinate':
+        coordinate(urls, args.queue, resume=args.resume, local_workers=args.local_workers)
+    else:
+        main(urls, resume=args.resume, incremental=args.incremental)
+    if args.export:
+        export_rows(args.export)
 
 
-create_folder()
-clear_files()
-main(MAIN_URL)
+# parse worker processes import this module, they must not start the crawl
+if __name__ == '__main__':
+    run_command(parse_args())
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+'''
+Offline benchmark of the fetch-and-parse pipeline.
+
+Serves the recorded pages from benchmarks/fixtures with a local HTTP server, runs get_people(),
+crawl_person() (preview parsing and declaration fetching), parse_decl() with every parser
+and the whole main() against it, and compares pages/sec and rows/sec with baseline.json.
+complete_content() is timed on long <br/>-separated cells against the string slicing it replaced.
+
+    python benchmarks/bench.py                  # run and compare with the baseline
+    python benchmarks/bench.py --save-baseline  # run and store the results as the new baseline
+'''
+import argparse
+import contextlib
+import io
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+BENCH_FOLDER = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_FOLDER = os.path.join(BENCH_FOLDER, 'fixtures')
+BASELINE_FILE = os.path.join(BENCH_FOLDER, 'baseline.json')
+sys.path.insert(0, os.path.dirname(BENCH_FOLDER))
+
+import Deputies_declarations_8th as dd
+
+# Share of the baseline value a result may lose before it is reported as regression
+TOLERANCE = 0.2
+
+ROUTES = [
+    (re.compile(r'^/fetch_mps'), lambda match: 'fetch_mps.html'),
+    (re.compile(r'^/declview/home/preview/\d+$'), lambda match: 'preview.html'),
+    (re.compile(r'^/declview/home/decl/(\d+)$'), lambda match: 'declaration_%s.html' % match.group(1)),
+    (re.compile(r'^/declview/home/GetFile/(\d+)$'), lambda match: 'declaration_%s.pdf' % match.group(1)),
+]
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    '''
+    Stand-in for w1.c1.rada.gov.ua and gapp.rada.gov.ua answering with the fixture pages
+    '''
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = self.fixture()
+        self.send_response(200 if body is not None else 404)
+        self.send_header('Content-Length', str(len(body or b'')))
+        self.end_headers()
+        self.wfile.write(body or b'')
+
+    def do_HEAD(self):
+        body = self.fixture()
+        self.send_response(200 if body is not None else 404)
+        self.send_header('Content-Length', str(len(body or b'')))
+        self.end_headers()
+
+    def fixture(self):
+        for pattern, file_name in ROUTES:
+            match = pattern.match(self.path)
+            if match and os.path.exists(os.path.join(FIXTURES_FOLDER, file_name(match))):
+                with open(os.path.join(FIXTURES_FOLDER, file_name(match)), 'rb') as f:
+                    return f.read()
+        return None
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def setup_module(base_url, folder):
+    '''
+    Points the crawler to the stand-in server and the temporary output folder
+    '''
+    dd.MAIN_URL_PATTERN = base_url + '/fetch_mps?skl_id=%s'
+    dd.MAIN_URL = dd.MAIN_URL_PATTERN % 9
+    dd.DECLARATION_LIST_URL_PATTERN = base_url + '/declview/home/preview/%s'
+    dd.DECLARATION_URL_PATTERN = base_url + '%s'
+    dd.FOLDER = folder
+    dd.TSV_FILE = folder + 'declarations.tsv'
+    dd.CSV_FILE = folder + 'list.csv'
+    dd.NO_DEC_FILE = folder + 'no_dec.csv'
+    dd.NO_PAGE_FILE = folder + 'no_page.csv'
+    dd.DEPUTIES_FILE = folder + 'deputies.csv'
+    dd.ARCHIVE_FILE = folder + 'archive.sqlite'
+    dd.BLOCKS_FILE = folder + 'blocks.json'
+    dd.CHANGES_FILE = folder + 'changes.jsonl'
+    dd.INDEX_FILE = folder + 'preview_index.json'
+    dd.QUEUE_FILE = folder + 'queue.sqlite'
+    dd.JOURNAL_FILE = folder + 'journal.jsonl'
+    dd.METRICS_FILE = folder + 'metrics.json'
+    dd.REQUESTS_LOG_FILE = folder + 'requests.csv'
+    dd.CACHE_MAX_AGE = []
+    dd.CACHE = dd.ResponseCache(folder + 'cache/')
+    dd.SCHEDULER = dd.RequestScheduler(0)
+    dd.METRICS = dd.RunMetrics()
+    dd.SESSION = dd.HTTPSession()
+
+
+def timed(function, repeat):
+    '''
+    Returns the best time of repeat runs and the result of the last run
+    '''
+    best = None
+    for n in range(repeat):
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = function()
+        seconds = time.perf_counter() - started
+        best = seconds if best is None else min(best, seconds)
+    return best, result
+
+
+def bench_get_people(repeat):
+    seconds, people_list = timed(lambda: dd.get_people(dd.MAIN_URL), repeat)
+    return {'get_people.pages_per_sec': 1 / seconds,
+            'get_people.deputies_per_sec': len(people_list) / seconds}
+
+
+def bench_crawl(repeat):
+    with contextlib.redirect_stdout(io.StringIO()):
+        people_list = dd.get_people(dd.MAIN_URL)
+
+    def crawl():
+        return [dd.crawl_person(person_id, person[1]) for person_id, person in people_list.items()]
+
+    seconds, results = timed(crawl, repeat)
+    # preview page and every declaration link
+    pages = sum(1 + len(result['declarations']) for result in results)
+    return {'crawl.pages_per_sec': pages / seconds,
+            'crawl.deputies_per_sec': len(results) / seconds}
+
+
+def bench_parse(repeat):
+    pages = []
+    for file_name in sorted(os.listdir(FIXTURES_FOLDER)):
+        if file_name.startswith('declaration_') and file_name.endswith('.html'):
+            with open(os.path.join(FIXTURES_FOLDER, file_name), 'rb') as f:
+                pages.append(f.read())
+    results = {}
+    for parser in dd.PARSERS:
+        def parse():
+            return sum(len(dd.parse_decl_rows(page, 'Петренко Іван Петрович', '2014', parser)[0]) for page in pages)
+
+        seconds, rows = timed(parse, repeat)
+        results['parse_%s.pages_per_sec' % parser] = len(pages) / seconds
+        results['parse_%s.rows_per_sec' % parser] = rows / seconds
+    return results
+
+
+def sliced_complete_content(p):
+    '''
+    complete_content() before it walked the cell by index: every step copied the rest of the cell
+    '''
+    res = list()
+    while '<' in p and p[:p.find('<')]:
+        new_string = p[:p.find('<')].strip('\r\n').replace('\r\n', '')
+        res.append(new_string)
+        p = p[p.find('>') + 1:]
+    return res
+
+
+def bench_complete_content(repeat):
+    # cells of 10, 100 and 1000 values like the sums of sections III-VI
+    cells = ['<br/>'.join('%d,%d' % (n * 1000 + i, i % 10) for i in range(n)) + '<br/>' for n in (10, 100, 1000)]
+    values = sum(len(dd.complete_content(cell)) for cell in cells)
+    results = {}
+    for name, function in (('complete_content', dd.complete_content),
+                           ('complete_content_sliced', sliced_complete_content)):
+        assert [function(cell) for cell in cells] == [dd.complete_content(cell) for cell in cells]
+        seconds, result = timed(lambda: [function(cell) for cell in cells for n in range(20)], repeat)
+        results['%s.values_per_sec' % name] = values * 20 / seconds
+    return results
+
+
+def bench_main(repeat):
+    def run():
+        dd.main(dd.MAIN_URL)
+        return sum(1 for row in dd.read_decl_rows())
+
+    seconds, rows = timed(run, repeat)
+    return {'main.rows_per_sec': rows / seconds}
+
+
+def compare(results, baseline, tolerance):
+    '''
+    Prints results against the baseline, returns names of the regressed benchmarks
+    '''
+    regressions = []
+    for name in sorted(results):
+        line = '%-40s %12.1f' % (name, results[name])
+        if name in baseline:
+            change = results[name] / baseline[name] - 1
+            line += '   baseline %12.1f  %+6.1f%%' % (baseline[name], change * 100)
+            if change < -tolerance:
+                line += '  REGRESSION'
+                regressions.append(name)
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmark of the fetch-and-parse pipeline')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of every benchmark, the best one counts')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help='allowed slowdown against the baseline (default: %(default)s)')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results in baseline.json')
+    args = parser.parse_args()
+
+    server = start_server()
+    folder = tempfile.mkdtemp(prefix='decl_bench_') + '/'
+    try:
+        setup_module('http://127.0.0.1:%d' % server.server_address[1], folder)
+        results = {}
+        for bench in (bench_get_people, bench_crawl, bench_parse, bench_complete_content, bench_main):
+            results.update(bench(args.repeat))
+    finally:
+        server.shutdown()
+        shutil.rmtree(folder, ignore_errors=True)
+
+    baseline = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE) as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    if args.save_baseline:
+        with open(BASELINE_FILE, 'w') as f:
+            json.dump(dict((name, round(value, 1)) for name, value in results.items()), f, indent=2, sort_keys=True)
+            f.write('\n')
+    elif regressions:
+        sys.exit('Regressions: ' + ', '.join(regressions))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+'''
+Offline checks of the parser on the recorded pages from benchmarks/fixtures.
+
+Every parser of PARSERS must give byte-identical TSV rows for every declaration page,
+and records cut short at the end of a table must be written the way parse_decl() always wrote them.
+A distributed crawl with several local workers against the fixture server must give the same output files,
+preview index and cache index as main(), and reparse() must rebuild the declarations of the last crawl.
+
+    python benchmarks/check.py      # or: python -m pytest benchmarks/check.py
+'''
+import contextlib
+import csv
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+BENCH_FOLDER = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_FOLDER = os.path.join(BENCH_FOLDER, 'fixtures')
+sys.path.insert(0, os.path.dirname(BENCH_FOLDER))
+
+import Deputies_declarations_8th as dd
+import bench
+
+PERSON_NAME = 'Петренко Іван Петрович'
+YEAR = '2014'
+
+
+def declaration_pages():
+    pages = []
+    for file_name in sorted(os.listdir(FIXTURES_FOLDER)):
+        if file_name.startswith('declaration_') and file_name.endswith('.html'):
+            with open(os.path.join(FIXTURES_FOLDER, file_name), 'rb') as f:
+                pages.append((file_name, f.read()))
+    return pages
+
+
+def tsv_rows(page, parser):
+    f = io.StringIO()
+    dd.feed_rows(dd.iter_decl_rows(page, PERSON_NAME, YEAR, parser), csv.writer(f, delimiter='\t'))
+    return f.getvalue()
+
+
+def fixture_with(old, new):
+    '''
+    declaration_1.html with old part replaced by new one
+    '''
+    page = dict(declaration_pages())['declaration_1.html'].decode('utf-8')
+    assert old in page
+    return page.replace(old, new, 1).encode('utf-8')
+
+
+def test_parsers_agree():
+    for file_name, page in declaration_pages():
+        expected = tsv_rows(page, dd.PARSERS[0])
+        assert expected.count('\n') > 1, file_name
+        for parser in dd.PARSERS[1:]:
+            assert tsv_rows(page, parser) == expected, '%s: %s differs from %s' % (file_name, parser, dd.PARSERS[0])
+
+
+def test_incomplete_transport_record():
+    # IV.A rows are written on the 5th cell of a record, a record of 3 or 4 cells gives nothing
+    page = fixture_with('</table>\n<table><tr><td>Мото</td>',
+                        '<tr><td>Причіп</td><td>Кремінь <br/></td><td>2001<br/></td><td>500<br/></td></tr>'
+                        '</table>\n<table><tr><td>Мото</td>')
+    for parser in dd.PARSERS:
+        assert tsv_rows(page, parser) == tsv_rows(fixture_with('', ''), parser), parser
+
+
+def test_incomplete_deposit_record():
+    # V rows in Ukraine are written on the 2nd cell of a record, before the cell of the sums abroad
+    last_record = '<tr><td>Вклади 2</td><td><br/></td><td><br/></td></tr>\n'
+    page = fixture_with(last_record, last_record + '<tr><td>Вклади 3</td><td>55<br/></td></tr>\n')
+    for parser in dd.PARSERS:
+        rows = list(csv.reader(io.StringIO(tsv_rows(page, parser)), delimiter='\t'))
+        expected = list(csv.reader(io.StringIO(tsv_rows(fixture_with('', ''), parser)), delimiter='\t'))
+        added = [row for row in rows if row not in expected]
+        assert len(rows) == len(expected) + 1, parser
+        assert [(row[dd.POINT_TITLE], row[dd.FIELDS.index('content')]) for row in added] == [('Вклади 3', '55')], parser
+
+
+def test_pdf_file_names():
+    names = dict((name, dd.PDF_FILE_NAMES.pop(name)) for name in list(dd.PDF_FILE_NAMES))
+    try:
+        assert dd.get_pdf_file_name('1', 'Джемілєв Мустафа', '/declview/home/GetFile/1', YEAR) is None
+        file_names = [dd.get_pdf_file_name(person_id, PERSON_NAME, href, YEAR) for person_id, href in
+                      [('1', '/declview/home/GetFile/4'), ('1', '/declview/home/GetFile/5'),
+                       ('2', '/declview/home/GetFile/4'), ('3', '/declview/home/GetFile/4')]]
+        assert len(set(file_names)) == len(file_names), file_names
+        # the same declaration keeps its name
+        assert dd.get_pdf_file_name('2', PERSON_NAME, '/declview/home/GetFile/4', YEAR) == file_names[2]
+    finally:
+        dd.PDF_FILE_NAMES.clear()
+        dd.PDF_FILE_NAMES.update(names)
+
+
+def test_stale_page_on_failure():
+    folder = tempfile.mkdtemp(prefix='decl_check_') + '/'
+    server = bench.start_server()
+    url = 'http://127.0.0.1:%d/fetch_mps' % server.server_address[1]
+    cache, retries = dd.CACHE, dd.RETRIES
+    dd.CACHE, dd.RETRIES = dd.ResponseCache(folder), {}
+    try:
+        dd.CACHE.put(url, {}, b'cached list')
+        # the list is older than its max age and the server is gone
+        dd.CACHE.entries[url]['fetched'] -= 2 * 60 * 60
+        server.shutdown()
+        server.server_close()
+        with contextlib.redirect_stdout(io.StringIO()):
+            assert dd.get_page(url, timeout=5) == b'cached list'
+    finally:
+        dd.CACHE, dd.RETRIES = cache, retries
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def test_metrics_failed_requests():
+    metrics = dd.RunMetrics()
+    for status, cache in ((200, 'miss'), (206, 'miss'), (304, 'revalidated'), ('', 'hit'), (404, 'miss'),
+                          ('timeout', 'miss')):
+        metrics.request('http://127.0.0.1/declview/home/GetFile/4', 0.1, 1,
+                        {'status': status, 'retries': 0, 'cache': cache})
+    assert metrics.summary()['by_url_class']['pdf']['failed'] == 2
+
+
+@contextlib.contextmanager
+def fixture_crawl(server, run):
+    '''
+    Runs run(url) in a temporary output folder against the fixture server, yields the folder
+    '''
+    folder = tempfile.mkdtemp(prefix='decl_check_') + '/'
+    settings = dict((name, getattr(dd, name)) for name in ('PARSE_WORKERS', 'QUEUE_POLL'))
+    try:
+        bench.setup_module('http://127.0.0.1:%d' % server.server_address[1], folder)
+        dd.PARSE_WORKERS = 0
+        dd.QUEUE_POLL = 0.1
+        with contextlib.redirect_stdout(io.StringIO()):
+            run(dd.MAIN_URL)
+        yield folder
+    finally:
+        for name, value in settings.items():
+            setattr(dd, name, value)
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def read_file(file_name):
+    with open(file_name, 'rb') as f:
+        return f.read()
+
+
+def cached_urls(folder):
+    with open(folder + 'cache/index.json', encoding='utf-8') as f:
+        return sorted(entry['url'] for entry in json.load(f))
+
+
+def test_reparse_after_smaller_crawl():
+    def crawl_twice(url):
+        dd.main(url)
+        # the second run drops most deputies, their pages must not come back with reparse
+        get_all_people = dd.get_all_people
+        dd.get_all_people = lambda urls: dict(list(get_all_people(urls).items())[:10])
+        try:
+            dd.main(url)
+        finally:
+            dd.get_all_people = get_all_people
+
+    server = bench.start_server()
+    try:
+        with fixture_crawl(server, crawl_twice) as folder:
+            crawled = read_file(folder + 'declarations.tsv')
+            with contextlib.redirect_stdout(io.StringIO()):
+                dd.reparse()
+            assert read_file(folder + 'declarations.tsv') == crawled
+    finally:
+        server.shutdown()
+
+
+def test_distributed_run():
+    server = bench.start_server()
+    try:
+        with fixture_crawl(server, dd.main) as single, \
+                fixture_crawl(server, lambda url: dd.coordinate(url, local_workers=3)) as distributed:
+            for file_name in ('declarations.tsv', 'list.csv', 'no_dec.csv', 'no_page.csv', 'deputies.csv'):
+                assert read_file(distributed + file_name) == read_file(single + file_name), file_name
+            # every worker's preview pages and cached pages are kept, not only the last saved ones
+            assert json.loads(read_file(distributed + 'preview_index.json')) == \
+                json.loads(read_file(single + 'preview_index.json'))
+            assert cached_urls(distributed) == cached_urls(single)
+    finally:
+        server.shutdown()
+
+
+def test_lease_renewal():
+    folder = tempfile.mkdtemp(prefix='decl_check_') + '/'
+    lease_seconds = dd.LEASE_SECONDS
+    dd.LEASE_SECONDS = 0.6
+    queue = dd.WorkQueue(folder + 'queue.sqlite')
+    stopped = threading.Event()
+    try:
+        queue.seed(OrderedDict([('1', ('', 'a')), ('2', ('', 'b'))]))
+        assert len(queue.lease('slow', 2)) == 2
+        heartbeat = threading.Thread(target=dd.renew_leases, args=(folder + 'queue.sqlite', 'slow', stopped))
+        heartbeat.start()
+        time.sleep(2 * dd.LEASE_SECONDS)
+        # the slow worker is still running, its deputies stay with it
+        assert queue.lease('other', 2) == []
+        stopped.set()
+        heartbeat.join()
+        time.sleep(2 * dd.LEASE_SECONDS)
+        assert len(queue.lease('other', 2)) == 2
+    finally:
+        stopped.set()
+        dd.LEASE_SECONDS = lease_seconds
+        queue.close()
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def test_distributed_workers_exit():
+    server = bench.start_server()
+    settings = (dd.PARSER, dd.PARSE_CHUNK_SIZE)
+    # the workers get the settings however they are started, with no chunk size every parse fails
+    dd.PARSER, dd.PARSE_CHUNK_SIZE = 'stream', 0
+    try:
+        with fixture_crawl(server, lambda url: dd.coordinate(url, local_workers=2)):
+            pass
+    except RuntimeError as error:
+        assert 'exit codes: 1, 1' in str(error), error
+    else:
+        assert False, 'coordinate() did not fail when its workers exited'
+    finally:
+        dd.PARSER, dd.PARSE_CHUNK_SIZE = settings
+        server.shutdown()
+
+
+def main():
+    failed = 0
+    for name, check in sorted(globals().items()):
+        if name.startswith('test_'):
+            try:
+                check()
+            except AssertionError as error:
+                failed += 1
+                print('%-40s FAILED %s' % (name, error))
+            else:
+                print('%-40s ok' % name)
+    if failed:
+        sys.exit('%d checks failed' % failed)
+
+
+if __name__ == '__main__':
+    main()